@@ -2,13 +2,73 @@
 Marc St. Pierre 1/13/2025
 This module provides functionality to analyze conversation transcripts and compute 
 various metrics. It also includes functionality to save processed 
-transcripts as JSON files.
+transcripts as JSON files or in columnar Parquet/Arrow format.
 """
 
 import json
+import os
+import re
+
 import pandas as pd
 
+import profiler
+import result_cache
+
+# Column types of the analysis schema, shared by the columnar output, the app and the visualizer
+INTEGER_COLUMNS = ['id', 'turn', 'airTime', 'wpm', 'responseID', 'coherenceID', 'repeatID']
+LABEL_COLUMNS = ['name', 'previous', 'qType', 'nType', 'topic', 'emotion']
+SCORE_COLUMNS = ['topicConfidence', 'emotionConfidence', 'responseScore', 'coherenceScore', 'repeatScore']
+
+# Mandate file of the example negotiation, with a '# Topics' list
+SAMPLE_TOPIC_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 "doc", "negotiation_mandates.md")
+# Mandate file whose '# Topics' list is used when no topics are given (e.g. SAMPLE_TOPIC_FILE);
+# with None, sentences are not assigned to topics
+TOPIC_FILE = None
+
+# Output file -> (analysis key, embeddings stored, size, modification time) of the files
+# written by analyze_transcript, so a cache hit can tell whether the file on disk is its own
+_written_outputs = {}
+
 # Helper Functions
+def _output_stamp(file_name):
+    stat = os.stat(file_name)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def apply_schema(df):
+    """
+    Convert a per-sentence DataFrame to the compact analysis schema.
+
+    IDs and counts become nullable Int32, labels become categoricals ('name' and
+    'previous' share one speaker category set so their codes can be compared) and
+    scores become float32. Columns outside the schema are left as they are.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame of per-sentence records.
+
+    Returns:
+    pd.DataFrame: The same records with schema dtypes.
+    """
+    dtypes = {}
+    for col in df.columns:
+        if col in INTEGER_COLUMNS:
+            dtypes[col] = 'Int32'
+        elif col in SCORE_COLUMNS:
+            dtypes[col] = 'float32'
+        elif col in LABEL_COLUMNS:
+            dtypes[col] = 'category'
+
+    speaker_columns = [col for col in ('name', 'previous') if col in df.columns]
+    if speaker_columns:
+        speakers = pd.concat([df[col].astype(object) for col in speaker_columns]).dropna().unique()
+        speaker_dtype = pd.CategoricalDtype(sorted(speakers))
+        for col in speaker_columns:
+            dtypes[col] = speaker_dtype
+
+    return df.astype(dtypes)
+
+
 def response_coverage(df):
     """
     Calculate the proportion of responses for each person to other people's statements.
@@ -22,10 +82,10 @@ def response_coverage(df):
           of responses made to other people's statements.
     """
     # Group statements by 'previous' and count unique 'id's for each name
-    statement_counts = df.groupby('previous')['id'].nunique()
+    statement_counts = df.groupby('previous', observed=True)['id'].nunique()
 
     # Group responses by 'name' and count unique 'responseID's for each name
-    response_counts = df.groupby('name')['responseID'].nunique()
+    response_counts = df.groupby('name', observed=True)['responseID'].nunique()
 
     result = {}
 
@@ -40,6 +100,7 @@ def response_coverage(df):
     return result
 
 
+@profiler.profiled
 def compute_metrics(df):
     """
     Compute various metrics for each person in the conversation.
@@ -53,14 +114,14 @@ def compute_metrics(df):
     dict: A dictionary where each key is a person's name and the value is another
           dictionary containing various computed metrics.
     """
-    avg_air_time = df.groupby(['name', 'turn'])['airTime'].sum().groupby('name').mean()
-    avg_wpm = df.groupby('name')['wpm'].mean()
-    avg_response = df.groupby('name')['responseScore'].mean()
-    avg_coherence = df.groupby('name')['coherenceScore'].mean()
-    count_questions = df.groupby(['name', 'qType'])['qType'].count()
-    count_narrative = df.groupby(['name', 'nType'])['nType'].count()
-    count_emotion = df.groupby(['name', 'emotion'])['emotion'].count()
-    count_topic = df.groupby(['name', 'topic'])['topic'].count()
+    avg_air_time = df.groupby(['name', 'turn'], observed=True)['airTime'].sum().groupby('name', observed=True).mean()
+    avg_wpm = df.groupby('name', observed=True)['wpm'].mean()
+    avg_response = df.groupby('name', observed=True)['responseScore'].mean()
+    avg_coherence = df.groupby('name', observed=True)['coherenceScore'].mean()
+    count_questions = df.groupby(['name', 'qType'], observed=True)['qType'].count()
+    count_narrative = df.groupby(['name', 'nType'], observed=True)['nType'].count()
+    count_emotion = df.groupby(['name', 'emotion'], observed=True)['emotion'].count()
+    count_topic = df.groupby(['name', 'topic'], observed=True)['topic'].count()
     prop_coverage = response_coverage(df)
 
     result = {}
@@ -82,30 +143,245 @@ def compute_metrics(df):
     return result
 
 
-def analyze_transcript(content, file_name):
+def _arrow_table(data, peaks=None, embeddings=None):
+    """
+    Build a typed Arrow table from per-sentence records.
+
+    IDs are nullable int32, labels are dictionary-encoded (categorical), scores are float32
+    and 'localMaxDistro' is a list<int32> column, taken from the records or from CSR
+    (indptr, indices) peaks. Embeddings are stored as a fixed-size list<float32> column.
     """
-    Analyze the transcript data, process it, and save the result as a JSON file.
+    import numpy as np
+    import pyarrow as pa
+
+    df = pd.DataFrame.from_records(data)
+    columns = {}
+    for col in df.columns:
+        if col == 'localMaxDistro':
+            continue
+        if col in INTEGER_COLUMNS:
+            columns[col] = pa.array(df[col], type=pa.int32(), from_pandas=True)
+        elif col in LABEL_COLUMNS:
+            columns[col] = pa.array(df[col], type=pa.string(), from_pandas=True).dictionary_encode()
+        elif col in SCORE_COLUMNS:
+            columns[col] = pa.array(df[col], type=pa.float32(), from_pandas=True)
+        else:
+            columns[col] = pa.array(df[col], from_pandas=True)
+
+    if peaks is not None:
+        indptr, indices = peaks
+        columns['localMaxDistro'] = pa.ListArray.from_arrays(
+            pa.array(np.asarray(indptr, dtype=np.int32)), pa.array(np.asarray(indices, dtype=np.int32))
+        )
+    elif 'localMaxDistro' in df.columns:
+        columns['localMaxDistro'] = pa.array(df['localMaxDistro'], type=pa.list_(pa.int32()))
+
+    if embeddings is not None:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        columns['embedding'] = pa.FixedSizeListArray.from_arrays(
+            pa.array(embeddings.ravel()), embeddings.shape[1]
+        )
+
+    return pa.table(columns)
+
+
+def save_transcript(data, file_name, peaks=None, embeddings=None):
+    """
+    Save processed transcript records, in a format chosen by the file extension.
+
+    Parameters:
+    data (list): Per-sentence records produced by parameterizer.parameterize.
+    file_name (str): Path of the file to write: .json, .parquet, or .arrow (Arrow IPC).
+    peaks (tuple): Optional CSR (indptr, indices) peaks for records without 'localMaxDistro'.
+    embeddings (np.ndarray): Optional sentence embeddings (columnar formats only).
+    """
+    extension = os.path.splitext(file_name)[1]
+
+    if extension == ".json":
+        if peaks is not None:
+            indptr, indices = peaks
+            data = [
+                dict(entry, localMaxDistro=indices[indptr[i]:indptr[i + 1]].tolist())
+                for i, entry in enumerate(data)
+            ]
+        with open(file_name, "w") as json_file:
+            json.dump(data, json_file, indent=4)
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(_arrow_table(data, peaks, embeddings), file_name)
+    elif extension in (".arrow", ".feather"):
+        import pyarrow as pa
+        table = _arrow_table(data, peaks, embeddings)
+        with pa.OSFile(file_name, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unsupported output format '{extension}'. Use .json, .parquet or .arrow.")
+
+
+def load_transcript(source, file_format=None):
+    """
+    Load processed transcript records into a DataFrame.
+
+    Parquet and Arrow files are memory mapped. Every format is converted to the analysis
+    schema (see apply_schema); 'localMaxDistro' loads as arrays from the columnar formats.
+
+    Parameters:
+    source (str or file-like): Path, or buffer holding the file contents.
+    file_format (str): 'json', 'parquet' or 'arrow'; taken from the extension of a path by default.
+
+    Returns:
+    pd.DataFrame: The per-sentence records.
+    """
+    if file_format is None:
+        file_format = os.path.splitext(source)[1].lstrip(".")
+
+    if file_format == "json":
+        return apply_schema(pd.read_json(source))
+
+    import pyarrow as pa
+
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(source, memory_map=isinstance(source, str))
+    elif file_format in ("arrow", "feather"):
+        stream = pa.memory_map(source, "r") if isinstance(source, str) else source
+        table = pa.ipc.open_file(stream).read_all()
+    else:
+        raise ValueError(f"Unsupported file format '{file_format}'. Use json, parquet or arrow.")
+
+    return apply_schema(table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get))
+
+
+def load_topics(file_name):
+    """
+    Read the topic list of a negotiation from a mandate file.
+
+    Topics are the bullet points ('- topic' or '* topic') under a '# Topics' heading of
+    any level, up to the next heading.
+
+    Parameters:
+    file_name (str): Path to a markdown mandate file such as doc/negotiation_mandates.md.
+
+    Returns:
+    list: The topics, or an empty list if the file has no topics section.
+    """
+    topics, in_section = [], False
+    with open(file_name, encoding="utf-8") as mandate_file:
+        for line in mandate_file:
+            if line.startswith("#"):
+                in_section = line.strip("# \n").lower() == "topics"
+                continue
+            match = re.match(r'\s*[-*]\s+(.+)', line)
+            if in_section and match:
+                topics.append(match.group(1).strip())
+    return topics
+
+
+def default_topics():
+    """Return the topics of the configured TOPIC_FILE, or None if no mandate file is configured."""
+    return load_topics(TOPIC_FILE) if TOPIC_FILE else None
+
+
+def analysis_key(content, anonymize_flag=False, topic_list=None):
+    """
+    Compute the result cache key of a transcript for the current pipeline and models.
+
+    Parameters:
+    content (str): Raw transcript content.
+    anonymize_flag (bool): Whether speaker names are anonymized during preprocessing.
+    topic_list (list): Topics the sentences are assigned to.
+
+    Returns:
+    str: Key under which the analysis of this content is cached.
+    """
+    import model_registry
+    import parameterizer
+
+    return result_cache.result_key(
+        content,
+        pipeline_version=parameterizer.PIPELINE_VERSION,
+        sentiment_model=model_registry.model_id("sentiment"),
+        sentence_model=model_registry.model_id("sentence"),
+        anonymize_flag=anonymize_flag,
+        topics=topic_list,
+    )
+
+
+def analyze_transcript(content, file_name, use_cache=True, output_format="json", store_embeddings=False,
+                       topic_list=None):
+    """
+    Analyze the transcript data, process it, and save the result next to the uploaded file.
 
     Parameters:
     content (str): Raw transcript content.
     file_name (str): The name of the file where the processed data will be saved.
+    use_cache (bool): Return a stored result when this content was already analyzed
+                      with the same pipeline version, models and parameters.
+    output_format (str): 'json', or a columnar format: 'parquet' or 'arrow'.
+    store_embeddings (bool): Also store the sentence embeddings (columnar formats only).
+    topic_list (list): Topics to assign sentences to (defaults to the topics of TOPIC_FILE, if set).
 
     Returns:
-    pd.DataFrame: A DataFrame loaded from the saved JSON file containing the processed data.
+    pd.DataFrame: A DataFrame loaded from the saved file containing the processed data.
     """
     import fathom_preprocessor
     import parameterizer
 
-    # Preprocess the file content
-    raw = fathom_preprocessor.prep_file(content, False)
+    if topic_list is None:
+        topic_list = default_topics()
+    key = analysis_key(content, topic_list=topic_list)
+    file_name = os.path.splitext(file_name)[0] + "." + output_format
+    with_embeddings = store_embeddings and output_format != "json"
+    # The returned frame is the one loaded from this kind of output file
+    variant = output_format + ("+embeddings" if with_embeddings else "")
+
+    with profiler.stage("result_cache"):
+        data, df = result_cache.load_result(key, variant) if use_cache else (None, None)
+
+    current_file = data is not None and os.path.exists(file_name) and \
+        _written_outputs.get(os.path.abspath(file_name)) == (key, with_embeddings, *_output_stamp(file_name))
+
+    if data is None:
+        # Preprocess the file content
+        with profiler.stage("prep_file"):
+            raw = fathom_preprocessor.prep_file(content, False)
+            profiler.count(len(raw[2]))
+
+        # Parameterize the raw data (speakers, timespans, transcripts)
+        data = parameterizer.parameterize(raw[0], raw[1], raw[2], topic_list=topic_list)
+
+    # A file written for this result and not changed since is kept
+    if not current_file:
+        # Embeddings were computed during parameterization, so this is served by the embedding cache
+        embeddings = None
+        if with_embeddings:
+            embeddings = parameterizer.sentence_encoder([entry['text'] for entry in data])
+
+        # Save the new file in the same location
+        with profiler.stage("save_transcript", len(data)):
+            save_transcript(data, file_name, embeddings=embeddings)
+        _written_outputs[os.path.abspath(file_name)] = (key, with_embeddings, *_output_stamp(file_name))
+
+    if df is None:
+        with profiler.stage("load_transcript", len(data)):
+            df = load_transcript(file_name)
+        result_cache.save_result(key, data, df, variant)
+
+    return apply_schema(df)
 
-    # Parameterize the raw data (speakers, timespans, transcripts)
-    data = parameterizer.parameterize(raw[0], raw[1], raw[2])
+    # Embeddings were computed during parameterization, so this is served by the embedding cache
+    embeddings = None
+    if with_embeddings:
+        embeddings = parameterizer.sentence_encoder([entry['text'] for entry in data])
 
-    # Save the new JSON file in the same location
-    file_name = file_name[:-3] + "json"
+    # Save the new file in the same location
+    with profiler.stage("save_transcript", len(data)):
+        save_transcript(data, file_name, embeddings=embeddings)
+    _written_outputs[os.path.abspath(file_name)] = (key, with_embeddings, *_output_stamp(file_name))
 
-    with open(file_name, "w") as json_file:
-        json.dump(data, json_file, indent=4)
+    if df is None:
+        with profiler.stage("load_transcript", len(data)):
+            df = load_transcript(file_name)
+        result_cache.save_result(key, data, df)
 
-    return pd.read_json(file_name)
\ No newline at end of file
+    return apply_schema(df)
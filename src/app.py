@@ -5,14 +5,35 @@ Basic Dash App implementation of Negotiations Analyzer Web Application
 
 import base64
 import io
+import math
+import re
 
 import pandas as pd
 import plotly.graph_objects as go
-from dash import Dash, dcc, html, dash_table, Input, Output, State
+from dash import Dash, dcc, html, dash_table, Input, Output, State, ctx, no_update
 
 import analyzer
+import figure_cache
+import profiler
+import session_store
 import visualizer
 
+# Build the figures of every single-filter selection in the background after an upload
+PREFILL_FIGURES = True
+
+# Profile every upload and show its per-stage timings in a collapsible Performance panel
+SHOW_PERFORMANCE = True
+PERFORMANCE_COLUMNS = ['stage', 'wall (ms)', 'cpu (ms)', 'items', 'items/s', 'peak RSS (MB)']
+
+TABLE_COLUMNS = ['id', 'name', 'text', 'responseID', 'coherenceID', 'repeatID']
+
+# DataTable filter query expressions, e.g. '{name} eq "A"' or '{id} >= 10'
+FILTER_PATTERN = re.compile(r'^\{(?P<column>[^}]*)\}\s+(?P<operator>\S+)\s*(?P<value>.*)$')
+FILTER_OPERATORS = {
+    'ge': 'ge', '>=': 'ge', 'le': 'le', '<=': 'le', 'lt': 'lt', '<': 'lt', 'gt': 'gt', '>': 'gt',
+    'ne': 'ne', '!=': 'ne', 'eq': 'eq', '=': 'eq', 'contains': 'contains', 'datestartswith': 'datestartswith'
+}
+
 # Initialize the Dash app
 app = Dash(__name__)
 app.title = "Negotiations Analysis Dashboard"
@@ -38,6 +59,9 @@ app.layout = html.Div([
         )
     ], style={'textAlign': 'center', 'marginBottom': '20px'}),
 
+    # Key of the parsed upload in the server-side session store
+    dcc.Store(id='dataset'),
+
     html.Div([
         dcc.Dropdown(
             id='topic-filter',
@@ -67,13 +91,26 @@ app.layout = html.Div([
     dcc.Graph(id='frequencies', style={'marginTop': '20px'}),
     dcc.Graph(id='repetitions', style={'marginTop': '20px'}),
 
+    html.Details([
+        html.Summary("Performance"),
+        html.Div(id='performance-table')
+    ], style={'marginTop': '20px', 'display': 'block' if SHOW_PERFORMANCE else 'none'}),
+
     html.Div([
         html.H3("Data Table:"),
         dash_table.DataTable(
             id="data-table",
             columns=[],
             data=[],
+            page_current=0,
             page_size=10,
+            page_count=0,
+            page_action='custom',
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
             style_table={"overflowX": "auto"},
             style_cell={
                 "textAlign": "left",
@@ -88,94 +125,343 @@ app.layout = html.Div([
     ])
 ])
 
+def error_figure(title, message):
+    return go.Figure({
+        "layout": {
+            "title": title,
+            "annotations": [{"text": message, "showarrow": False}]
+        }
+    })
+
+
+def filter_frame(df, selected_topic, selected_emotion, selected_ntype):
+    """Slice the DataFrame by the selected filter values."""
+    filtered_df = df
+    if selected_topic:
+        filtered_df = filtered_df[filtered_df['topic'] == selected_topic]
+    if selected_emotion:
+        filtered_df = filtered_df[filtered_df['emotion'] == selected_emotion]
+    if selected_ntype:
+        filtered_df = filtered_df[filtered_df['nType'] == selected_ntype]
+    return filtered_df
+
+
+def make_legend(df):
+    """Create a legend dictionary with unique 'name' values mapped to colors."""
+    unique_names = df['name'].unique()
+    colors = ['blue', 'red']
+    return {name: colors[i % len(colors)] for i, name in enumerate(unique_names)}
+
+
+def build_figures(filtered_df, legend):
+    """Generate the four dashboard figures using visualizer with the legend passed."""
+    summary = visualizer.summarize(filtered_df)
+    return (
+        visualizer.plot_cluster_response_and_coherence(filtered_df, legend),
+        visualizer.plot_proportions_response_and_coherence(filtered_df, legend, summary),
+        visualizer.plot_frequency_response_and_coherence(filtered_df, legend, summary),
+        visualizer.plot_repetition(filtered_df, legend, summary),
+    )
+
+
+def split_filter_part(filter_part):
+    """Split one DataTable filter expression into (column, operator, value)."""
+    match = FILTER_PATTERN.match(filter_part.strip())
+    if not match or match['operator'] not in FILTER_OPERATORS:
+        return None, None, None
+
+    value = match['value'].strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in ('"', "'", '`'):
+        value = value[1:-1]
+    else:
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    return match['column'], FILTER_OPERATORS[match['operator']], value
+
+
+def query_frame(df, filter_query):
+    """Apply a DataTable filter query (expressions joined by '&&') to the DataFrame."""
+    for filter_part in (filter_query or '').split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in df.columns:
+            continue
+        if operator in ('contains', 'datestartswith'):
+            text = df[column].astype(str)
+            mask = text.str.contains(str(value), regex=False) if operator == 'contains' else text.str.startswith(str(value))
+        else:
+            series = df[column]
+            if not pd.api.types.is_numeric_dtype(series):
+                # Labels are unordered categoricals, so they are compared as text
+                series, value = series.astype(str), str(value)
+            try:
+                mask = getattr(series, operator)(value)
+            except TypeError:
+                # e.g. a numeric column ordered against text; the expression is ignored
+                continue
+        df = df[mask.fillna(False).astype(bool)]
+    return df
+
+
+def zoom_range(relayout_data):
+    """
+    Read the visible ID range from a graph's relayoutData.
+
+    Returns:
+        tuple: (is_zoom, x_range); x_range is None when the graph was zoomed back out.
+    """
+    for axis in ('xaxis', 'xaxis2'):
+        if f'{axis}.range[0]' in relayout_data:
+            first, last = relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']
+        elif f'{axis}.range' in relayout_data:
+            first, last = relayout_data[f'{axis}.range']
+        elif relayout_data.get(f'{axis}.autorange'):
+            return True, None
+        else:
+            continue
+        return True, [int(math.floor(first)), int(math.ceil(last))]
+    return False, None
+
+
+def performance_rows(profile):
+    """Format the stage records of a profile as rows of the Performance panel."""
+    rows = []
+    for record in profile.summary():
+        rate = record['items'] / record['wall'] if record['items'] and record['wall'] else None
+        rows.append({
+            'stage': record['stage'],
+            'wall (ms)': round(record['wall'] * 1000, 1),
+            'cpu (ms)': round(record['cpu'] * 1000, 1),
+            'items': record['items'],
+            'items/s': round(rate) if rate is not None else None,
+            'peak RSS (MB)': round(record['peak_rss_mb']) if record['peak_rss_mb'] is not None else None,
+        })
+    return rows
+
+
+def prefill_jobs(key, df):
+    """Yield (cache key, build) pairs for the unfiltered data and every single filter value."""
+    selections = [(None, None, None)]
+    selections += [(topic, None, None) for topic in df['topic'].dropna().unique()]
+    selections += [(None, emotion, None) for emotion in df['emotion'].dropna().unique()]
+    selections += [(None, None, ntype) for ntype in df['nType'].dropna().unique()]
+
+    for topic, emotion, ntype in selections:
+        filtered_df = filter_frame(df, topic, emotion, ntype)
+        legend = make_legend(filtered_df)
+        yield (
+            figure_cache.figure_key(key, topic, emotion, ntype, legend),
+            lambda filtered_df=filtered_df, legend=legend: build_figures(filtered_df, legend)
+        )
+
+
 @app.callback(
     [
+        Output('dataset', 'data'),
         Output('topic-filter', 'options'),
         Output('emotion-filter', 'options'),
-        Output('ntype-filter', 'options'),
+        Output('ntype-filter', 'options')
+    ],
+    [Input('upload-data', 'contents')],
+    [State('upload-data', 'filename')]
+)
+def load_upload(contents, filename):
+    """Parse an upload once and keep the DataFrame in the server-side session store."""
+    if not contents:
+        return None, [], [], []
+
+    key = session_store.upload_key(contents)
+    df = session_store.get(key)
+
+    if df is None:
+        # Parse uploaded file
+        content_type, content_string = contents.split(',')
+        decoded = base64.b64decode(content_string)
+
+        try:
+            # Without the Performance panel nothing is measured
+            with profiler.profile(filename) if SHOW_PERFORMANCE else profiler.activate(None) as profile:
+                if filename.endswith('.txt'):
+                    # Analyze .txt file
+                    df = analyzer.analyze_transcript(decoded.decode('utf-8'), filename)
+                elif filename.endswith('.json'):
+                    # Read JSON file
+                    df = analyzer.load_transcript(io.StringIO(decoded.decode('utf-8')), 'json')
+                elif filename.endswith(('.parquet', '.arrow')):
+                    # Read columnar file
+                    df = analyzer.load_transcript(io.BytesIO(decoded), filename.rsplit('.', 1)[1])
+                else:
+                    raise ValueError("Unsupported file format. Please upload a Fathom transcript .txt or a preprocessed .json, .parquet or .arrow file.")
+        except Exception as e:
+            return {'error': str(e)}, [], [], []
+
+        session_store.put(key, df, profile)
+        if profile is not None:
+            profile.log()
+        if PREFILL_FIGURES:
+            figure_cache.prefill(prefill_jobs(key, df))
+
+    # Prepare filter options
+    topic_options = [{'label': topic, 'value': topic} for topic in df['topic'].dropna().unique()]
+    emotion_options = [{'label': emotion, 'value': emotion} for emotion in df['emotion'].unique()]
+    ntype_options = [{'label': ntype, 'value': ntype} for ntype in df['nType'].unique()]
+
+    return {'key': key}, topic_options, emotion_options, ntype_options
+
+
+@app.callback(
+    [
         Output('cluster', 'figure'),
         Output('proportions', 'figure'),
         Output('frequencies', 'figure'),
-        Output('repetitions', 'figure'),
-        Output("data-table", "columns"),
-        Output("data-table", "data")
+        Output('repetitions', 'figure')
     ],
     [
-        Input('upload-data', 'contents'),
+        Input('dataset', 'data'),
         Input("topic-filter", "value"),
         Input("emotion-filter", "value"),
         Input("ntype-filter", "value")
-    ],
-    [State('upload-data', 'filename')]
+    ]
 )
-def update_graph(contents, selected_topic, selected_emotion, selected_ntype, filename):
-    if not contents:
+def update_graph(dataset, selected_topic, selected_emotion, selected_ntype):
+    """Slice the stored DataFrame by the selected filters and redraw the figures."""
+    if not dataset:
         empty_fig = go.Figure({"layout": {"title": "No Data Available"}})
-        return [], [], [], empty_fig, empty_fig, empty_fig, empty_fig, [], []
+        return empty_fig, empty_fig, empty_fig, empty_fig
+
+    if 'error' in dataset:
+        error_fig = error_figure("Error Parsing File", dataset['error'])
+        return error_fig, error_fig, error_fig, error_fig
+
+    df = session_store.get(dataset['key'])
+    if df is None:
+        error_fig = error_figure("Session Expired", "Please upload the file again.")
+        return error_fig, error_fig, error_fig, error_fig
 
-    # Parse uploaded file
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
+    # Apply filters
+    filtered_df = filter_frame(df, selected_topic, selected_emotion, selected_ntype)
+    legend = make_legend(filtered_df)
 
+    # Reuse the figures of a selection that was rendered (or prefilled) before. Each update is
+    # profiled separately and replaces the previous figure profile of the upload
     try:
-        if filename.endswith('.txt'):
-            # Analyze .txt file
-            df = analyzer.analyze_transcript(decoded.decode('utf-8'), filename)
-        elif filename.endswith('.json'):
-            # Read JSON file
-            df = pd.read_json(io.StringIO(decoded.decode('utf-8')))
-        else:
-            raise ValueError("Unsupported file format. Please upload a Fathom transcript .txt or a preprocessed .json file.")
+        key = figure_cache.figure_key(dataset['key'], selected_topic, selected_emotion, selected_ntype, legend)
+        with profiler.profile("figures") if SHOW_PERFORMANCE else profiler.activate(None) as profile, \
+                profiler.stage("figures", len(filtered_df)):
+            fig1, fig2, fig3, fig4 = figure_cache.get_or_build(key, lambda: build_figures(filtered_df, legend))
+        if profile is not None:
+            session_store.put_profile(dataset['key'], profile, "figures")
     except Exception as e:
-        error_fig = go.Figure({
-            "layout": {
-                "title": "Error Parsing File",
-                "annotations": [{"text": str(e), "showarrow": False}]
-            }
-        })
-        return [], [], [], error_fig, error_fig, error_fig, error_fig, [], []
+        error_fig = error_figure("Error Generating Visualization", str(e))
+        return error_fig, error_fig, error_fig, error_fig
 
-    # Prepare filter options
-    topic_options = [{'label': topic, 'value': topic} for topic in df['topic'].unique()]
-    emotion_options = [{'label': emotion, 'value': emotion} for emotion in df['emotion'].unique()]
-    ntype_options = [{'label': ntype, 'value': ntype} for ntype in df['nType'].unique()]
+    return fig1, fig2, fig3, fig4
 
-    # Apply filters
-    filtered_df = df
-    if selected_topic:
-        filtered_df = filtered_df[filtered_df['topic'] == selected_topic]
-    if selected_emotion:
-        filtered_df = filtered_df[filtered_df['emotion'] == selected_emotion]
-    if selected_ntype:
-        filtered_df = filtered_df[filtered_df['nType'] == selected_ntype]
 
-    # Create a legend dictionary with unique 'name' values mapped to colors
-    unique_names = filtered_df['name'].unique()
-    colors = ['blue', 'red']
-    legend = {name: colors[i % len(colors)] for i, name in enumerate(unique_names)}
+@app.callback(
+    [
+        Output("data-table", "columns"),
+        Output("data-table", "data"),
+        Output("data-table", "page_count"),
+        Output("data-table", "page_current")
+    ],
+    [
+        Input('dataset', 'data'),
+        Input("topic-filter", "value"),
+        Input("emotion-filter", "value"),
+        Input("ntype-filter", "value"),
+        Input("data-table", "page_current"),
+        Input("data-table", "page_size"),
+        Input("data-table", "sort_by"),
+        Input("data-table", "filter_query")
+    ]
+)
+def update_table(dataset, selected_topic, selected_emotion, selected_ntype,
+                 page_current, page_size, sort_by, filter_query):
+    """Send only the requested page of the filtered and sorted table."""
+    df = session_store.get(dataset['key']) if dataset and 'key' in dataset else None
+    if df is None:
+        return [], [], 0, 0
 
-    # Generate the figures using visualizer with the legend passed
-    try:
-        fig1 = visualizer.plot_cluster_response_and_coherence(filtered_df, legend)
-        fig2 = visualizer.plot_proportions_response_and_coherence(filtered_df, legend)
-        fig3 = visualizer.plot_frequency_response_and_coherence(filtered_df, legend)
-        fig4 = visualizer.plot_repetition(filtered_df, legend)
-    except Exception as e:
-        error_fig = go.Figure({
-            "layout": {
-                "title": "Error Generating Visualization",
-                "annotations": [{"text": str(e), "showarrow": False}]
-            }
-        })
-        return topic_options, emotion_options, ntype_options, error_fig, error_fig, error_fig, error_fig, [], []
+    # A new dataset, filter, sort or table query starts again from the first page
+    if "data-table.page_current" not in ctx.triggered_prop_ids:
+        page_current = 0
+
+    filtered_df = filter_frame(df, selected_topic, selected_emotion, selected_ntype)[TABLE_COLUMNS]
+    filtered_df = query_frame(filtered_df, filter_query)
+
+    if sort_by:
+        filtered_df = filtered_df.sort_values(
+            [col['column_id'] for col in sort_by],
+            ascending=[col['direction'] == 'asc' for col in sort_by],
+            kind='stable'
+        )
+
+    page_count = max(1, math.ceil(len(filtered_df) / page_size))
+    page_current = min(page_current, page_count - 1)
+    page = filtered_df.iloc[page_current * page_size:(page_current + 1) * page_size]
+
+    table_columns = [{"name": col, "id": col} for col in TABLE_COLUMNS]
+    return table_columns, page.to_dict("records"), page_count, page_current
+
+@app.callback(
+    [
+        Output('frequencies', 'figure', allow_duplicate=True),
+        Output('repetitions', 'figure', allow_duplicate=True)
+    ],
+    [
+        Input('frequencies', 'relayoutData'),
+        Input('repetitions', 'relayoutData')
+    ],
+    [
+        State('dataset', 'data'),
+        State("topic-filter", "value"),
+        State("emotion-filter", "value"),
+        State("ntype-filter", "value")
+    ],
+    prevent_initial_call=True
+)
+def zoom_bars(frequency_zoom, repetition_zoom, dataset, selected_topic, selected_emotion, selected_ntype):
+    """Re-aggregate the ID-indexed bar chart that was zoomed, for long transcripts."""
+    relayout_data = frequency_zoom if ctx.triggered_id == 'frequencies' else repetition_zoom
+    is_zoom, x_range = zoom_range(relayout_data or {})
+
+    df = session_store.get(dataset['key']) if dataset and 'key' in dataset else None
+    if not is_zoom or df is None or df['id'].max() + 1 <= visualizer.MAX_BARS:
+        # Short transcripts are sent unbinned, so the browser zooms on its own
+        return no_update, no_update
+
+    filtered_df = filter_frame(df, selected_topic, selected_emotion, selected_ntype)
+    legend = make_legend(filtered_df)
+    summary = visualizer.summarize(filtered_df)
+
+    if ctx.triggered_id == 'frequencies':
+        return visualizer.plot_frequency_response_and_coherence(filtered_df, legend, summary, x_range), no_update
+    return no_update, visualizer.plot_repetition(filtered_df, legend, summary, x_range)
+
+
+@app.callback(
+    Output('performance-table', 'children'),
+    [
+        Input('dataset', 'data'),
+        Input('repetitions', 'figure')
+    ]
+)
+def update_performance(dataset, _figure):
+    """Show the stage timings of the current upload and of its last figure update."""
+    key = dataset['key'] if dataset and 'key' in dataset else None
+    profiles = [session_store.get_profile(key, part) for part in ("upload", "figures")] if key else []
+    rows = [row for profile in profiles if profile is not None for row in performance_rows(profile)]
+    if not rows:
+        return html.P("No performance data for this upload.")
 
-    # Prepare table data
-    required_columns = ['id', 'name', 'text', 'responseID', 'coherenceID', 'repeatID']
-    filtered_df = filtered_df[required_columns]
-    table_columns = [{"name": col, "id": col} for col in filtered_df.columns]
-    table_data = filtered_df.to_dict("records")
+    return dash_table.DataTable(
+        columns=[{'name': col, 'id': col} for col in PERFORMANCE_COLUMNS],
+        data=rows,
+        style_cell={'textAlign': 'left'},
+    )
 
-    return topic_options, emotion_options, ntype_options, fig1, fig2, fig3, fig4, table_columns, table_data
 
 if __name__ == '__main__':
     app.run_server(debug=True)
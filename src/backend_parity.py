@@ -0,0 +1,103 @@
+"""
+Marc St. Pierre 10/18/2026
+Accuracy-parity check of the quantized ONNX inference backend against the PyTorch models.
+Both backends label and embed the sentences of the given transcripts, and the script reports
+label agreement, similarity score error and the speed-up of each stage.
+
+Usage:
+    python src/backend_parity.py samples/*.txt
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import fathom_preprocessor
+import model_registry
+import parameterizer
+
+# Minimum share of sentences whose sentiment label must not change
+MIN_LABEL_AGREEMENT = 0.95
+# Maximum mean absolute change of the sentence similarity scores
+MAX_SIMILARITY_ERROR = 0.02
+
+
+# Helper functions
+def sample_sentences(paths):
+    """Preprocess and segment transcripts into the sentences that parameterize would score."""
+    sentence_list = []
+    for path in paths:
+        with open(path, encoding="utf-8") as transcript_file:
+            raw = fathom_preprocessor.prep_file(transcript_file, False)
+        sentence_list.extend(parameterizer.sentence_records(raw[0], raw[1], raw[2])[1])
+    return sentence_list
+
+
+def run_backend(backend, sentence_list, batch_size=32):
+    """Label and embed sentences with one backend, timing each stage."""
+    sentiment_pipeline = model_registry.load_with_backend("sentiment", backend)
+    sentence_pipeline = model_registry.load_with_backend("sentence", backend)
+
+    started = time.perf_counter()
+    labels = [result['label'] for result in sentiment_pipeline(sentence_list, batch_size=batch_size)]
+    sentiment_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    embeddings = sentence_pipeline.encode(sentence_list, batch_size=batch_size)
+    similarities = np.asarray(sentence_pipeline.similarity(embeddings, embeddings), dtype=np.float32)
+    sentence_time = time.perf_counter() - started
+
+    return {'labels': labels, 'similarities': similarities,
+            'sentiment_time': sentiment_time, 'sentence_time': sentence_time}
+
+
+# Main functions
+def compare_backends(paths, batch_size=32):
+    """
+    Compare the ONNX backend against the PyTorch backend on the sentences of transcripts.
+
+    Parameters:
+        paths (list): Fathom .txt transcripts to draw sentences from.
+        batch_size (int): Inference batch size of both backends.
+
+    Returns:
+        dict: Label agreement, similarity errors, speed-ups and whether parity holds.
+    """
+    sentence_list = sample_sentences(paths)
+    reference = run_backend("torch", sentence_list, batch_size)
+    candidate = run_backend("onnx", sentence_list, batch_size)
+
+    error = np.abs(candidate['similarities'] - reference['similarities'])
+    report = {
+        'sentences': len(sentence_list),
+        'label_agreement': float(np.mean(np.array(candidate['labels']) == np.array(reference['labels']))),
+        'similarity_mean_error': float(error.mean()),
+        'similarity_max_error': float(error.max()),
+        'sentiment_speedup': reference['sentiment_time'] / candidate['sentiment_time'],
+        'sentence_speedup': reference['sentence_time'] / candidate['sentence_time'],
+    }
+    report['passed'] = report['label_agreement'] >= MIN_LABEL_AGREEMENT and \
+        report['similarity_mean_error'] <= MAX_SIMILARITY_ERROR
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the ONNX backend against the PyTorch models.")
+    parser.add_argument("transcripts", nargs="+", help="Fathom .txt transcripts")
+    parser.add_argument("-b", "--batch-size", type=int, default=32, help="inference batch size")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--inter-op-threads", type=int, default=0, help="ONNX Runtime inter-op threads")
+    args = parser.parse_args(argv)
+
+    # The thread settings apply to the ONNX sessions loaded by the comparison
+    model_registry.set_backend("torch", args.intra_op_threads, args.inter_op_threads)
+    report = compare_backends(args.transcripts, args.batch_size)
+    for name, value in report.items():
+        print(f"{name:<24} {value:.4f}" if isinstance(value, float) else f"{name:<24} {value}")
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Marc St. Pierre 10/18/2026
+Command-line batch analysis of Fathom transcripts. Preprocessing runs in a process pool,
+while a few long-lived model workers load the AI models once and parameterize every file.
+
+Usage:
+    python src/batch_analyzer.py samples/ "exports/*.txt" --output-dir results
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import analyzer
+import fathom_preprocessor
+
+MANIFEST_NAME = "manifest.json"
+SPEAKER_MAP_NAME = "speakers.json"
+
+
+# Helper functions
+def find_transcripts(inputs):
+    """Expand directories and glob patterns into a sorted list of transcript .txt files."""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.update(glob.glob(os.path.join(item, "*.txt")))
+        else:
+            paths.update(path for path in glob.glob(item) if path.endswith(".txt"))
+    return sorted(os.path.abspath(path) for path in paths)
+
+
+def load_manifest(output_dir):
+    """Load the record of transcripts already analyzed into output_dir."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(output_dir, manifest):
+    """Write the manifest atomically so an interrupted run can resume from it."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def input_root(paths):
+    """Return the deepest directory containing every transcript (None without transcripts)."""
+    return os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else None
+
+
+def output_path(output_dir, transcript_path, output_format="json", root=None):
+    """
+    Name the result file of a transcript inside output_dir.
+
+    The result keeps the transcript's location below root, so round1/meeting.txt and
+    round2/meeting.txt do not share a result file.
+    """
+    relative = os.path.relpath(transcript_path, root) if root else os.path.basename(transcript_path)
+    return os.path.join(output_dir, f"{os.path.splitext(relative)[0]}.{output_format}")
+
+
+def _preprocess(transcript_path, anonymize_flag, backend="torch", topic_list=None):
+    """
+    Read and preprocess one transcript (runs in the preprocessing pool).
+
+    Speaker names are only cleaned here; they are anonymized in the main process with the
+    speaker mapping shared by all transcripts.
+    """
+    import model_registry
+
+    # Selecting the backend loads nothing; it only makes the key reflect the backend's models
+    model_registry.set_backend(backend)
+    with open(transcript_path, encoding="utf-8") as transcript_file:
+        content = transcript_file.read()
+    key = analyzer.analysis_key(content, anonymize_flag, topic_list)
+    return key, fathom_preprocessor.prep_file(content, False)
+
+
+def _init_model_worker(threads, backend="torch"):
+    """Load the models once per model worker and share the cores between workers."""
+    import torch
+    import model_registry
+
+    torch.set_num_threads(threads)
+    model_registry.set_backend(backend, intra_op_threads=threads, inter_op_threads=1)
+    model_registry.warm_up(["sentiment", "sentence"])
+
+
+def _parameterize(raw, topic_list=None):
+    """Parameterize one preprocessed transcript (runs in a model worker)."""
+    import torch
+    import parameterizer
+
+    # The pipeline stages share the cores given to this worker
+    return parameterizer.parameterize(raw[0], raw[1], raw[2], thread_budget=torch.get_num_threads(),
+                                      topic_list=topic_list)
+
+
+# Main functions
+def analyze_directory(inputs, output_dir, workers=None, model_workers=1, anonymize_flag=False, resume=True,
+                      output_format="json", backend="torch", topic_list=None):
+    """
+    Analyze many transcripts and write one result file per transcript to output_dir.
+
+    Parameters:
+        inputs (list): Directories and/or glob patterns of Fathom .txt transcripts.
+        output_dir (str): Directory for the results and the resume manifest.
+        workers (int): Size of the preprocessing pool (defaults to the number of cores).
+        model_workers (int): Number of model-holding inference workers.
+        anonymize_flag (bool): Replace speaker names with SpeakerN. The numbering is shared by all
+                               transcripts and kept in output_dir/speakers.json.
+        resume (bool): Skip transcripts whose result for the same content and settings exists.
+        output_format (str): 'json', 'parquet' or 'arrow'.
+        backend (str): Inference backend of the models, 'torch' or 'onnx' (see model_registry).
+        topic_list (list): Topics to assign sentences to (see analyzer.load_topics).
+
+    Returns:
+        dict: Manifest mapping transcript paths to their analysis key and output file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // model_workers)
+
+    paths = find_transcripts(inputs)
+    root = input_root(paths)
+    manifest = load_manifest(output_dir) if resume else {}
+    speaker_map_path = os.path.join(output_dir, SPEAKER_MAP_NAME)
+    speaker_map = fathom_preprocessor.load_speaker_map(speaker_map_path) if resume else {}
+    done, total, started = 0, len(paths), time.time()
+
+    def report(path, status):
+        nonlocal done
+        done += 1
+        elapsed = time.time() - started
+        print(f"[{done}/{total}] {status:<8} {path} ({elapsed:.1f}s)", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=workers) as prep_pool, \
+            ProcessPoolExecutor(max_workers=model_workers, initializer=_init_model_worker,
+                                initargs=(threads, backend)) as model_pool:
+        pending = {prep_pool.submit(_preprocess, path, anonymize_flag, backend, topic_list): ("prep", path) for path in paths}
+        keys = {}
+
+        # Preprocessed transcripts are released in path order, so speakers are numbered deterministically
+        prepared, next_path = {}, 0
+
+        def release(path, result):
+            key, raw = result
+            if anonymize_flag:
+                raw[0] = fathom_preprocessor.process_speaker_names(raw[0], True, speaker_map)
+                fathom_preprocessor.save_speaker_map(speaker_map, speaker_map_path)
+            entry = manifest.get(path)
+            if entry and entry["key"] == key and entry["output"] == output_path(output_dir, path, output_format, root) \
+                    and os.path.exists(entry["output"]):
+                report(path, "skipped")
+                return
+            keys[path] = key
+            pending[model_pool.submit(_parameterize, raw, topic_list)] = ("model", path)
+
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, path = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    report(path, "failed")
+                    print(f"    {type(e).__name__}: {e}", file=sys.stderr)
+                    result = None
+
+                if stage == "prep":
+                    prepared[path] = result
+                    while next_path < len(paths) and paths[next_path] in prepared:
+                        ready = prepared.pop(paths[next_path])
+                        if ready is not None:
+                            release(paths[next_path], ready)
+                        next_path += 1
+                elif result is not None:
+                    file_name = output_path(output_dir, path, output_format, root)
+                    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+                    analyzer.save_transcript(result, file_name)
+                    manifest[path] = {"key": keys.pop(path), "output": file_name}
+                    save_manifest(output_dir, manifest)
+                    report(path, "analyzed")
+
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a batch of Fathom transcripts.")
+    parser.add_argument("inputs", nargs="+", help="directories or glob patterns of .txt transcripts")
+    parser.add_argument("-o", "--output-dir", default="results", help="directory for the result files")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="preprocessing processes")
+    parser.add_argument("-m", "--model-workers", type=int, default=1, help="model-holding inference processes")
+    parser.add_argument("-f", "--format", default="json", choices=["json", "parquet", "arrow"],
+                        help="output format of the result files")
+    parser.add_argument("-b", "--backend", default="torch", choices=["torch", "onnx"],
+                        help="inference backend: PyTorch fp32 or quantized int8 ONNX Runtime")
+    parser.add_argument("-t", "--topics", default=None,
+                        help="mandate file with a '# Topics' list to assign sentences to (default: none)")
+    parser.add_argument("--anonymize", action="store_true", help="replace speaker names with SpeakerN")
+    parser.add_argument("--no-resume", action="store_true", help="re-analyze transcripts that already have results")
+    args = parser.parse_args(argv)
+
+    analyze_directory(
+        args.inputs, args.output_dir, args.workers, args.model_workers,
+        args.anonymize, resume=not args.no_resume, output_format=args.format, backend=args.backend,
+        topic_list=analyzer.load_topics(args.topics) if args.topics else analyzer.default_topics()
+    )
+
+
+if __name__ == '__main__':
+    main()
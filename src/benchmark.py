@@ -0,0 +1,302 @@
+"""
+Marc St. Pierre 10/18/2026
+Reproducible benchmark of the analysis pipeline on synthetic Fathom transcripts. Every stage is
+timed separately and its throughput and peak memory are reported; results can be stored as a
+JSON baseline and later runs fail when a stage regresses. The AI models are replaced by
+deterministic local stubs by default, so the suite runs offline.
+
+Usage:
+    python src/benchmark.py --turns 400 --save-baseline bench_baseline.json
+    python src/benchmark.py --turns 400 --baseline bench_baseline.json
+"""
+
+import argparse
+import copy
+import json
+import random
+import sys
+import time
+import tracemalloc
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import analyzer
+import embedding_cache
+import fathom_preprocessor
+import model_registry
+import parameterizer
+import visualizer
+
+# Allowed slowdown (or memory growth) of a stage relative to the baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.25
+# Stages faster than this are too noisy to compare against a baseline
+MIN_COMPARED_SECONDS = 0.005
+
+WORDS = (
+    "the a to and of we you they he she i our your their it this that algae snails village fish "
+    "harvest drug research lab ecosystem economy elders money offer trust time future island bay "
+    "water food people island need want can will could would should think know see take give "
+    "keep grow help protect share pay cost years small large more less first last other new"
+).split()
+QUESTION_STARTS = ["why", "how", "what", "can", "would", "do"]
+EMOTIONS = ["negative", "neutral", "positive"]
+
+
+# Synthetic transcripts
+def _timestamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+
+def generate_transcript(turns=200, speakers=2, sentence_words=12, sentences_per_turn=3, seed=0):
+    """
+    Generate a Fathom-format transcript of a controlled size.
+
+    Parameters:
+        turns (int): Number of speaker turns.
+        speakers (int): Number of distinct speakers; consecutive turns change speaker.
+        sentence_words (int): Average number of words per sentence.
+        sentences_per_turn (int): Average number of sentences per turn.
+        seed (int): Seed of the random generator, so equal arguments give equal transcripts.
+
+    Returns:
+        str: The transcript, in the format read by fathom_preprocessor.prep_file.
+    """
+    rng = random.Random(seed)
+    names = [f"Speaker {idx + 1}" for idx in range(speakers)]
+
+    lines, elapsed, speaker = [], 0, None
+    for _ in range(turns):
+        choices = [name for name in names if name != speaker] or names
+        speaker = rng.choice(choices)
+
+        sentences = []
+        for _ in range(max(1, round(rng.gauss(sentences_per_turn, 1)))):
+            words = [rng.choice(WORDS) for _ in range(max(2, round(rng.gauss(sentence_words, 3))))]
+            if rng.random() < 0.2:
+                words[0] = rng.choice(QUESTION_STARTS)
+                sentences.append(" ".join(words).capitalize() + "?")
+            else:
+                sentences.append(" ".join(words).capitalize() + ".")
+        text = "  ".join(sentences)
+
+        lines.append(f"{_timestamp(elapsed)} - {speaker}\n  {text}\n")
+        # Roughly 150 words per minute
+        elapsed += max(1, round(len(text.split()) * 60 / 150))
+
+    header = (
+        f"Synthetic Negotiation - {turns} turns\n"
+        f"VIEW RECORDING - {elapsed // 60 + 1} mins (No highlights): https://fathom.video/share/synthetic\n\n---\n\n"
+    )
+    return header + "\n".join(lines)
+
+
+# Deterministic model stubs
+class StubSentimentModel:
+    """Stand-in for the sentiment pipeline: labels and scores are derived from a hash of the text."""
+
+    def tokenizer(self, sentence_list):
+        return {'input_ids': [sentence.split() for sentence in sentence_list]}
+
+    def __call__(self, sentence_list, batch_size=None, **kwargs):
+        if isinstance(sentence_list, str):
+            sentence_list = [sentence_list]
+        results = []
+        for sentence in sentence_list:
+            digest = zlib.crc32(sentence.encode("utf-8"))
+            results.append({'label': EMOTIONS[digest % 3], 'score': 0.5 + (digest >> 8) % 500 / 1000})
+        return results
+
+
+class StubSentenceModel:
+    """Stand-in for the sentence model: normalized sums of fixed pseudo-random word vectors."""
+
+    def __init__(self, dim=64):
+        self.dim = dim
+        self._vectors = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _word_vector(self, word):
+        if word not in self._vectors:
+            rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+            self._vectors[word] = rng.standard_normal(self.dim).astype(np.float32)
+        return self._vectors[word]
+
+    def encode(self, sentence_list, batch_size=32, **kwargs):
+        embeddings = np.zeros((len(sentence_list), self.dim), dtype=np.float32)
+        for row, sentence in enumerate(sentence_list):
+            for word in sentence.lower().split():
+                embeddings[row] += self._word_vector(word.strip(".,?!"))
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def similarity(self, embeddings_a, embeddings_b):
+        return np.asarray(embeddings_a, dtype=np.float32) @ np.asarray(embeddings_b, dtype=np.float32).T
+
+
+def install_stub_models(dim=64):
+    """Replace the sentiment and sentence models with the stubs and disable the embedding cache."""
+    model_registry.register_model("sentiment", StubSentimentModel, size_mb=0)
+    model_registry.register_model("sentence", lambda: StubSentenceModel(dim), size_mb=0)
+    embedding_cache.set_cache_dir(None)
+
+
+# Measurement
+def time_stage(function, setup=None, items=1, repeat=3):
+    """
+    Time one stage and measure its peak memory.
+
+    Parameters:
+        function (callable): The stage, called with the arguments returned by setup().
+        setup (callable): Builds fresh arguments for every run (not timed).
+        items (int): Number of items (turns, sentences, ...) processed per run.
+        repeat (int): Timed runs; the fastest one is reported.
+
+    Returns:
+        dict: 'seconds', 'items', 'items_per_second' and 'peak_mb' of the stage.
+    """
+    setup = setup or (lambda: ())
+    best = float("inf")
+    for _ in range(repeat):
+        arguments = setup()
+        started = time.perf_counter()
+        function(*arguments)
+        best = min(best, time.perf_counter() - started)
+
+    # Memory is traced in a separate run because tracing slows allocations down
+    arguments = setup()
+    tracemalloc.start()
+    function(*arguments)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'seconds': best,
+        'items': items,
+        'items_per_second': items / best if best > 0 else float("inf"),
+        'peak_mb': peak / 2**20,
+    }
+
+
+def run_benchmark(turns=200, speakers=2, sentence_words=12, sentences_per_turn=3, seed=0, repeat=3,
+                  stub_models=True):
+    """
+    Time every stage of the pipeline on a synthetic transcript.
+
+    Returns:
+        dict: 'config' (the arguments that define the workload) and 'stages' (time_stage
+              results by stage name, in pipeline order).
+    """
+    config = {'turns': turns, 'speakers': speakers, 'sentence_words': sentence_words,
+              'sentences_per_turn': sentences_per_turn, 'seed': seed, 'stub_models': stub_models}
+    if stub_models:
+        install_stub_models()
+
+    content = generate_transcript(turns, speakers, sentence_words, sentences_per_turn, seed)
+    raw = fathom_preprocessor.prep_file(content, False)
+    records, sentence_list = parameterizer.sentence_records(raw[0], raw[1], raw[2])
+    embeddings = parameterizer.sentence_encoder(sentence_list)
+    similarities = parameterizer.similarity_detector(sentence_list, embeddings)
+    data = parameterizer.parameterize(raw[0], raw[1], raw[2])
+    df = analyzer.apply_schema(pd.DataFrame(data))
+    summary = visualizer.summarize(df)
+    names = df['name'].cat.categories
+    legend = {name: color for name, color in zip(names, ['blue', 'red'] * len(names))}
+    emotion_legend = {'negative': 'red', 'neutral': 'gray', 'positive': 'green'}
+    sentences = len(sentence_list)
+
+    stages = {
+        'prep_file': (lambda: fathom_preprocessor.prep_file(content, False), None, turns),
+        'segmentation': (lambda: parameterizer.sentence_records(raw[0], raw[1], raw[2]), None, sentences),
+        'sentiment': (lambda: parameterizer.affect_batch_detector(sentence_list), None, sentences),
+        'embedding': (lambda: parameterizer.sentence_encoder(sentence_list), None, sentences),
+        'similarity': (lambda: parameterizer.similarity_detector(sentence_list, embeddings), None, sentences),
+        'response_coherence': (
+            parameterizer.responsiveness_coherence_detector, lambda: (copy.deepcopy(records), similarities),
+            sentences
+        ),
+        'local_maxima': (lambda: parameterizer.local_max_detector(similarities), None, sentences),
+        'parameterize': (lambda: parameterizer.parameterize(raw[0], raw[1], raw[2]), None, sentences),
+        'compute_metrics': (lambda: analyzer.compute_metrics(df), None, sentences),
+        'plot_wpma_air_time': (lambda: visualizer.plot_wpma_air_time(df, legend), None, sentences),
+        'plot_narrative_emotion': (lambda: visualizer.plot_narrative_emotion(df, emotion_legend), None, sentences),
+        'plot_cluster': (lambda: visualizer.plot_cluster_response_and_coherence(df, legend), None, sentences),
+        'plot_proportions': (
+            lambda: visualizer.plot_proportions_response_and_coherence(df, legend, summary), None, sentences
+        ),
+        'plot_frequency': (
+            lambda: visualizer.plot_frequency_response_and_coherence(df, legend, summary), None, sentences
+        ),
+        'plot_repetition': (lambda: visualizer.plot_repetition(df, legend, summary), None, sentences),
+    }
+
+    results = {}
+    for name, (function, setup, items) in stages.items():
+        results[name] = time_stage(function, setup, items, repeat)
+    return {'config': config, 'stages': results}
+
+
+def find_regressions(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare a benchmark report with a baseline of the same workload.
+
+    Returns:
+        list: One message per stage whose time or peak memory grew by more than tolerance.
+    """
+    if report['config'] != baseline['config']:
+        raise ValueError(f"Baseline workload {baseline['config']} differs from {report['config']}")
+
+    regressions = []
+    for name, result in report['stages'].items():
+        reference = baseline['stages'].get(name)
+        if reference is None:
+            continue
+        if reference['seconds'] >= MIN_COMPARED_SECONDS and result['seconds'] > reference['seconds'] * (1 + tolerance):
+            regressions.append(f"{name}: {result['seconds']:.4f}s vs {reference['seconds']:.4f}s baseline")
+        if result['peak_mb'] > reference['peak_mb'] * (1 + tolerance) + 1:
+            regressions.append(f"{name}: {result['peak_mb']:.1f} MB vs {reference['peak_mb']:.1f} MB baseline")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on synthetic transcripts.")
+    parser.add_argument("--turns", type=int, default=200, help="speaker turns in the transcript")
+    parser.add_argument("--speakers", type=int, default=2, help="distinct speakers")
+    parser.add_argument("--sentence-words", type=int, default=12, help="average words per sentence")
+    parser.add_argument("--sentences-per-turn", type=int, default=3, help="average sentences per turn")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the transcript generator")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (the fastest counts)")
+    parser.add_argument("--real-models", action="store_true", help="use the real AI models instead of stubs")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="fail if a stage regressed compared to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.turns, args.speakers, args.sentence_words, args.sentences_per_turn, args.seed,
+                           args.repeat, stub_models=not args.real_models)
+
+    print(f"{'stage':<24}{'seconds':>10}{'items/s':>12}{'peak MB':>10}")
+    for name, result in report['stages'].items():
+        print(f"{name:<24}{result['seconds']:>10.4f}{result['items_per_second']:>12.0f}{result['peak_mb']:>10.1f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as json_file:
+            json.dump(report, json_file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            baseline = json.load(json_file)
+        try:
+            regressions = find_regressions(report, baseline, args.tolerance)
+        except ValueError as e:
+            parser.error(str(e))
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
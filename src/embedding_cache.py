@@ -0,0 +1,288 @@
+"""
+Marc St. Pierre 10/18/2026
+This module provides a persistent, content-addressed cache for sentence embeddings so that
+sentences seen in earlier runs do not need to be encoded again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache files are then only safe within one process
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "negotiations-analyzer", "embeddings")
+DEFAULT_MAX_ENTRIES = 100000
+# The index log is compacted once it holds twice as many records as entries (at least this many)
+INDEX_COMPACT_MIN = 1024
+
+_lock = threading.Lock()
+_caches = {}
+_cache_dir = DEFAULT_CACHE_DIR
+
+
+# Helper functions
+def normalize_text(sentence):
+    """Normalize a sentence before hashing so whitespace differences share one entry."""
+    return " ".join(sentence.split())
+
+
+def text_key(sentence):
+    """Hash the normalized text of a sentence."""
+    return hashlib.sha1(normalize_text(sentence).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Size-bounded embedding store for one model, kept in a memory-mapped .npy file with an
+    append-only index log mapping text hashes to rows. Least recently used rows are evicted
+    when full. Processes sharing the cache files coordinate through a file lock.
+
+    Parameters:
+        cache_dir (str): Directory holding the cache files.
+        model_name (str): Name of the embedding model; each model gets its own files.
+        dim (int): Embedding dimension.
+        dtype (str): Storage dtype, 'float32' (exact) or 'float16' (half the disk size).
+        max_entries (int): Maximum number of cached sentences.
+    """
+
+    def __init__(self, cache_dir, model_name, dim, dtype="float32", max_entries=DEFAULT_MAX_ENTRIES):
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        safe_name = model_name.replace("/", "__")
+        os.makedirs(cache_dir, exist_ok=True)
+        self._vector_path = os.path.join(cache_dir, f"{safe_name}.{self.dtype.name}.npy")
+        self._index_path = os.path.join(cache_dir, f"{safe_name}.{self.dtype.name}.index.jsonl")
+        self._lock_path = os.path.join(cache_dir, f"{safe_name}.{self.dtype.name}.lock")
+
+        # Text hash -> (row, last use) and row -> text hash
+        self._index = {}
+        self._slots = {}
+        # Rows looked up since the last store, whose recency is not logged yet
+        self._touched = set()
+        self._clock = 0
+        # Generation of the index log (renewed by every compaction) and position up to which it was applied
+        self._generation = None
+        self._log_offset = 0
+        self._log_lines = 0
+
+        with self._lock, self._file_lock(exclusive=True):
+            self._open()
+            self._catch_up()
+
+    def __len__(self):
+        return len(self._index)
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """Hold the inter-process lock of the cache files (thread lock only without fcntl)."""
+        if fcntl is None:
+            yield
+            return
+        # Opened on every call: a descriptor inherited across fork would share the lock
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open(self):
+        if os.path.exists(self._vector_path) and os.path.exists(self._index_path):
+            vectors = np.load(self._vector_path, mmap_mode="r+")
+            with open(self._index_path) as index_file:
+                header = json.loads(index_file.readline() or "{}")
+            if vectors.shape == (self.max_entries, self.dim) and header.get("dim") == self.dim:
+                self._vectors = vectors
+                return
+
+        # Missing or incompatible cache files are recreated empty
+        self._vectors = np.lib.format.open_memmap(
+            self._vector_path, mode="w+", dtype=self.dtype, shape=(self.max_entries, self.dim)
+        )
+        self._compact()
+
+    def _catch_up(self):
+        """Apply the index records that other processes appended since the last read."""
+        with open(self._index_path, "rb") as index_file:
+            header = json.loads(index_file.readline())
+            size = os.fstat(index_file.fileno()).st_size
+            if header.get("generation") != self._generation or size < self._log_offset:
+                # The log was compacted (replaced) by another process: read it from the start
+                self._index, self._slots = {}, {}
+                self._generation, self._log_offset, self._log_lines = header.get("generation"), 0, 0
+            index_file.seek(max(self._log_offset, index_file.tell()))
+            for line in index_file:
+                record = json.loads(line)
+                self._apply(*record)
+                self._log_lines += 1
+            self._log_offset = index_file.tell()
+
+    def _apply(self, key, slot, clock):
+        """Place a text hash in a row (evicting the previous occupant) or refresh its recency."""
+        entry = self._index.get(key)
+        if entry is not None and entry[0] == slot:
+            self._index[key] = (slot, max(clock, entry[1]))
+        else:
+            if entry is not None:
+                del self._slots[entry[0]]
+            previous = self._slots.get(slot)
+            if previous is not None:
+                del self._index[previous]
+            self._index[key] = (slot, clock)
+            self._slots[slot] = key
+        self._clock = max(self._clock, clock)
+
+    def lookup(self, sentence_list):
+        """
+        Look up many sentences at once.
+
+        Returns:
+            tuple: A float32 array of shape (len(sentence_list), dim) holding the cached
+                   embeddings (zeros for misses) and the list of indices that missed.
+        """
+        embeddings = np.zeros((len(sentence_list), self.dim), dtype=np.float32)
+        hit_positions, hit_slots, missing = [], [], []
+
+        with self._lock, self._file_lock(exclusive=False):
+            self._catch_up()
+            self._clock += 1
+            for idx, sentence in enumerate(sentence_list):
+                key = text_key(sentence)
+                entry = self._index.get(key)
+                if entry is None:
+                    missing.append(idx)
+                    continue
+                self._index[key] = (entry[0], self._clock)
+                self._touched.add(key)
+                hit_positions.append(idx)
+                hit_slots.append(entry[0])
+
+            if hit_slots:
+                embeddings[hit_positions] = self._vectors[hit_slots]
+
+        return embeddings, missing
+
+    def store(self, sentence_list, embeddings):
+        """Add embeddings for the given sentences, evicting old entries if the cache is full."""
+        embeddings = np.asarray(embeddings)
+        with self._lock, self._file_lock(exclusive=True):
+            self._catch_up()
+            self._clock += 1
+            keys = {}
+            for sentence, embedding in zip(sentence_list, embeddings):
+                keys.setdefault(text_key(sentence), embedding)
+
+            # Recency of the rows looked up since the last store comes first, so that
+            # rows evicted below end up evicted
+            records = [[key, *self._index[key]] for key in self._touched if key in self._index]
+            self._touched.clear()
+
+            new_keys = [key for key in keys if key not in self._index]
+            for key, slot in zip(new_keys, self._free_slots(len(new_keys))):
+                self._vectors[slot] = keys[key]
+                records.append([key, slot, self._clock])
+
+            for record in records:
+                self._apply(*record)
+            self._vectors.flush()
+            self._append(records)
+
+    def _free_slots(self, count):
+        """Return up to `count` rows to fill: unused rows first, then least recently used ones."""
+        # Rows are filled in order and evicted rows are refilled at once, so rows
+        # 0..len(index)-1 are always the used ones
+        count = min(count, self.max_entries)
+        free = list(range(len(self._index), min(len(self._index) + count, self.max_entries)))
+
+        if len(free) < count:
+            by_age = sorted(self._index.values(), key=lambda entry: entry[1])
+            free += [slot for slot, _ in by_age[:count - len(free)]]
+
+        return free
+
+    def _append(self, records):
+        """Append records to the index log, compacting it once it is twice the size of the index."""
+        if self._log_lines + len(records) > 2 * max(len(self._index), INDEX_COMPACT_MIN):
+            self._compact()
+            return
+        with open(self._index_path, "ab") as index_file:
+            index_file.write("".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+            self._log_offset = index_file.tell()
+        self._log_lines += len(records)
+
+    def _compact(self):
+        """Rewrite the index log as one record per entry, oldest first, under a new generation."""
+        entries = sorted(self._index.items(), key=lambda item: item[1][1])
+        # Compared by readers instead of the file identity, since a replaced file may reuse the inode
+        generation = os.urandom(8).hex()
+        lines = [json.dumps({"dim": self.dim, "generation": generation})]
+        lines += [json.dumps([key, slot, clock]) for key, (slot, clock) in entries]
+        content = ("\n".join(lines) + "\n").encode("utf-8")
+        with open(self._index_path + ".tmp", "wb") as index_file:
+            index_file.write(content)
+        os.replace(self._index_path + ".tmp", self._index_path)
+        self._generation = generation
+        self._log_offset, self._log_lines = len(content), len(entries)
+
+
+# Main functions
+def set_cache_dir(cache_dir):
+    """Point the shared caches at another directory, or disable caching with None."""
+    global _cache_dir
+    with _lock:
+        _cache_dir = cache_dir
+        _caches.clear()
+
+
+def get_cache(model_name, dim, dtype="float32"):
+    """Return the shared cache for a model, or None if caching is disabled."""
+    with _lock:
+        if _cache_dir is None:
+            return None
+        key = (model_name, dim, dtype)
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(_cache_dir, model_name, dim, dtype)
+        return _caches[key]
+
+
+def cached_encode(encode, model_name, dim, sentence_list, dtype="float32"):
+    """
+    Embed sentences through the shared cache, calling `encode` only for cache misses.
+
+    Parameters:
+        encode (callable): Function mapping a list of sentences to an array of embeddings.
+        model_name (str): Name of the embedding model, part of the cache key.
+        dim (int): Embedding dimension.
+        sentence_list (list): Sentences to embed.
+
+    Returns:
+        np.ndarray: float32 embeddings of shape (len(sentence_list), dim).
+    """
+    cache = get_cache(model_name, dim, dtype)
+    if cache is None:
+        return np.asarray(encode(sentence_list), dtype=np.float32)
+
+    embeddings, missing = cache.lookup(sentence_list)
+    if missing:
+        # Repeated sentences within one call are encoded once
+        unique = {}
+        for idx in missing:
+            unique.setdefault(normalize_text(sentence_list[idx]), []).append(idx)
+        new_sentences = [sentence_list[positions[0]] for positions in unique.values()]
+        new_embeddings = np.asarray(encode(new_sentences), dtype=np.float32)
+        for positions, embedding in zip(unique.values(), new_embeddings):
+            embeddings[positions] = embedding
+        cache.store(new_sentences, new_embeddings)
+
+    return embeddings
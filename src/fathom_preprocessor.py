@@ -3,20 +3,36 @@ Marc St. Pierre 1/13/2025
 This module pre-processes transcript outputs (in txt format) from the Fathom video conferencing software.
 """
 
+import io
+import json
+import os
 import re
-import datetime
-import time
+
+# Line patterns of a Fathom transcript
+RECORDING_PATTERN = re.compile(r'VIEW RECORDING\s-\s(\d+)')
+TURN_PATTERN = re.compile(r'^(\d{1,2}(?::\d{2}){1,2})\s*-+\s+(.+?)\s*$')
+LINK_PATTERN = re.compile(r'[A-Z]+:.+=\d{1,}\.\d{1,}')
+
 
 # Helper functions
+def parse_timestamp(stamp):
+    """Convert an M:SS, MM:SS or H:MM:SS timestamp to seconds."""
+    seconds = 0
+    for part in stamp.strip().split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
 def convert_time(time_list, total_time):
     """Convert string timestamps to total seconds elapsed."""
-    temp_list = []
-    for t in time_list:
-        x = time.strptime(t.strip(), '%M:%S')
-        x = int(datetime.timedelta(minutes=x.tm_min, seconds=x.tm_sec).total_seconds())
-        temp_list.append(x)
+    return timespans([parse_timestamp(t) for t in time_list], total_time)
 
-    # Append total time 
+
+def timespans(start_list, total_time):
+    """Convert the start of each turn (in seconds) to the seconds spoken on each turn."""
+    temp_list = list(start_list)
+
+    # Append total time
     temp_list.append(total_time)
 
     # Convert total seconds elapsed to total seconds spoken on each turn
@@ -28,18 +44,50 @@ def convert_time(time_list, total_time):
     return output_list
 
 
-def process_speaker_names(name_list, anonymize_flag=True):
-    """Anonymize or clean speaker names."""
-    output_list = name_list
+def process_speaker_names(name_list, anonymize_flag=True, speaker_map=None):
+    """
+    Anonymize or clean speaker names in a single pass.
+
+    Parameters:
+        name_list (list): Speaker name of every turn.
+        anonymize_flag (bool): Replace the names with SpeakerN, numbered by first appearance.
+        speaker_map (dict): Cleaned name -> SpeakerN mapping to reuse; new speakers are added
+                            to it, so passing the same mapping for every meeting of a
+                            negotiation keeps the anonymized IDs consistent.
+
+    Returns:
+        list: The cleaned or anonymized names.
+    """
+    cleaned = {}
+    output_list = []
+    for name in name_list:
+        if name not in cleaned:
+            cleaned[name] = name.strip('- \n\r')
+        output_list.append(cleaned[name])
+
     if anonymize_flag:
-        for idx, speaker in enumerate(set(output_list)):
-            output_list = [name.replace(speaker, f"Speaker{idx}") for name in output_list]
-    else:
-        for idx, speaker in enumerate(set(output_list)):
-            output_list = [name.replace(speaker, speaker.strip('- \n\r')) for name in output_list]
+        speaker_map = {} if speaker_map is None else speaker_map
+        for name in output_list:
+            if name not in speaker_map:
+                speaker_map[name] = f"Speaker{len(speaker_map)}"
+        output_list = [speaker_map[name] for name in output_list]
     return output_list
 
 
+def load_speaker_map(file_name):
+    """Load a speaker mapping saved with save_speaker_map (empty if the file does not exist)."""
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name, encoding="utf-8") as json_file:
+        return json.load(json_file)
+
+
+def save_speaker_map(speaker_map, file_name):
+    """Save a speaker mapping as JSON."""
+    with open(file_name, "w", encoding="utf-8") as json_file:
+        json.dump(speaker_map, json_file, indent=4)
+
+
 def clean_text(transcription_list):
     """Clean up transcription values."""
     transcription_list = [t.strip().replace('\n', ' ') for t in transcription_list]
@@ -52,36 +100,75 @@ def clean_text(transcription_list):
     return transcription_list
 
 
+def read_header(lines):
+    """
+    Consume the header of a transcript, up to and including the '---' line.
+
+    Parameters:
+        lines (iterator): Lines of the transcript, e.g. an open file.
+
+    Returns:
+        int: Total time of the conversation in seconds (0 if the header does not state it).
+    """
+    total_time = 0
+    for line in lines:
+        if line.startswith('---'):
+            break
+        match = RECORDING_PATTERN.search(line)
+        if match:
+            total_time = int(match.group(1)) * 60
+    return total_time
+
+
+def iter_turns(lines):
+    """
+    Parse the turns of a transcript in a single pass over its lines.
+
+    Only the lines of the current turn are held in memory, so arbitrarily long transcripts
+    can be streamed from a file.
+
+    Parameters:
+        lines (iterator): Lines following the transcript header (see read_header).
+
+    Yields:
+        tuple: (speaker, start in seconds, text) of every turn.
+    """
+    speaker, start, text = None, 0, []
+    for line in lines:
+        match = TURN_PATTERN.match(line)
+        if match:
+            if speaker is not None:
+                yield speaker, start, ' '.join(text)
+            speaker, start, text = match.group(2), parse_timestamp(match.group(1)), []
+        elif speaker is not None and line.strip():
+            # Remove hyperlinks of highlights and bookmarks
+            text.append(LINK_PATTERN.sub(' ', line).strip())
+
+    if speaker is not None:
+        yield speaker, start, ' '.join(text)
+
+
 # Main function
-def prep_file(content, anonymize_flag=True):
-    """Prepare and clean transcript content."""
-    # Extract and convert the total time of the conversation from minutes to seconds
-    total_convo_time = re.search(r'(?:VIEW RECORDING)\s-\s\d{1,}', content)
-    if total_convo_time:
-        total_convo_time = int(total_convo_time.group().split(" ")[-1]) * 60
-    else:
-        total_convo_time = 0
-
-    # Remove hyperlinks and irrelevant content
-    content = re.sub(r'[A-Z]+:.+=\d{1,}\.\d{1,}', ' ', content)
-    content = content[content.find("---"):]
-
-    # Split content by timestamps or speaker identifiers
-    content = re.split(r'(\d{1,2}\:\d{2}\s?)|(\-+\s.+\D\n)', content)[1:]
-    content = list(filter(None, content))
-
-    # Initialize basic info lists
-    timestamps = []
+def prep_file(content, anonymize_flag=True, speaker_map=None):
+    """
+    Prepare and clean transcript content (a string, an open file or an iterator of lines).
+
+    A speaker_map is used and extended when anonymizing (see process_speaker_names).
+    """
+    lines = iter(io.StringIO(content) if isinstance(content, str) else content)
+    total_convo_time = read_header(lines)
+
     speakers = []
+    starts = []
     transcripts = []
-
-    # Assign values to individual lists
-    for idx, item in enumerate(content):
-        [timestamps, speakers, transcripts][idx % 3].append(item)
+    for speaker, start, text in iter_turns(lines):
+        speakers.append(speaker)
+        starts.append(start)
+        transcripts.append(text)
 
     # Process and clean data
-    timespans = convert_time(timestamps, total_convo_time)
-    speakers = process_speaker_names(speakers, anonymize_flag)
+    spans = timespans(starts, total_convo_time)
+    speakers = process_speaker_names(speakers, anonymize_flag, speaker_map)
     transcripts = clean_text(transcripts)
 
-    return [speakers, timespans, transcripts]
+    return [speakers, spans, transcripts]
@@ -0,0 +1,83 @@
+"""
+Marc St. Pierre 10/18/2026
+This module caches the dashboard figures per dataset and filter selection, so switching
+back to a combination that was already rendered does not rebuild the figures.
+"""
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 64
+
+_lock = threading.Lock()
+_figures = OrderedDict()
+_max_entries = DEFAULT_MAX_ENTRIES
+
+
+def figure_key(dataset_key, topic, emotion, ntype, legend):
+    """Build the cache key of a dataset, filter selection and legend."""
+    return (dataset_key, topic, emotion, ntype, tuple(sorted(legend.items())))
+
+
+def set_max_entries(max_entries):
+    """Change the number of cached figure sets, evicting the oldest ones if needed."""
+    global _max_entries
+    with _lock:
+        _max_entries = max_entries
+        _evict()
+
+
+def get(key):
+    """Return the cached figures of a key, or None."""
+    with _lock:
+        if key not in _figures:
+            return None
+        _figures.move_to_end(key)
+        return _figures[key]
+
+
+def put(key, figures):
+    """Cache the figures of a key."""
+    with _lock:
+        _figures[key] = figures
+        _figures.move_to_end(key)
+        _evict()
+
+
+def get_or_build(key, build):
+    """Return the cached figures of a key, building and caching them with build() on a miss."""
+    figures = get(key)
+    if figures is None:
+        figures = build()
+        put(key, figures)
+    return figures
+
+
+def prefill(jobs):
+    """
+    Build figures in a background thread so they are cached before they are requested.
+
+    Parameters:
+        jobs (iterable): (key, build) pairs; keys that are already cached are skipped.
+
+    Returns:
+        threading.Thread: The started daemon thread.
+    """
+    def run():
+        for key, build in jobs:
+            if get(key) is not None:
+                continue
+            try:
+                put(key, build())
+            except Exception:
+                # Failing selections are built (and reported) again when requested
+                continue
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _evict():
+    while len(_figures) > _max_entries:
+        _figures.popitem(last=False)
@@ -0,0 +1,101 @@
+"""
+Marc St. Pierre 10/18/2026
+This module matches the words of many sentences against lexicons of word categories at once.
+Sentences are tokenized together, tokens are mapped to integer IDs, and the categories of
+every sentence are found with array operations, so additional categories cost no extra pass.
+"""
+
+import re
+
+import numpy as np
+
+# Categories in order of priority: the first matching category of a sentence wins
+NARRATIVE_LEXICON = {
+    # Third person comes first because it matters most to know when people talk about other people
+    'third': {
+        'he', 'him', 'his', 'she', 'her', 'hers', 'they', 'them', 'their', 'theirs',
+        'themself', 'themselves', 'herself', 'himself'
+    },
+    'second': {"you", "your", "yours", "yourself", "yourselves"},
+    'first': {'i', "me", "my", "we", "our", "mine", "ours", "us", "myself", "ourselves"},
+}
+QUESTION_LEXICON = {
+    'openEnded': {"why", "how", "what"},
+}
+
+# Joins the sentences of a batch; never part of a token
+SEPARATOR = "\x00"
+
+
+class LexiconEngine:
+    """
+    Flag the lexicon categories present in each sentence of a batch.
+
+    Parameters:
+        categories (dict): Category name -> set of lowercase words, in order of priority.
+        delimiters (str): Characters separating words in addition to whitespace.
+        ignore (str): Optional regex of phrases removed before tokenizing (e.g. filler phrases).
+    """
+
+    def __init__(self, categories, delimiters="'", ignore=None):
+        self.categories = list(categories)
+        self.delimiters = delimiters
+        self.ignore = re.compile(ignore) if ignore else None
+
+        # Token ID 0 is any word outside the lexicons, the last ID is the sentence separator
+        self.vocabulary = {}
+        for words in categories.values():
+            for word in words:
+                self.vocabulary.setdefault(word, len(self.vocabulary) + 1)
+        self.separator_id = len(self.vocabulary) + 1
+        self.vocabulary[SEPARATOR] = self.separator_id
+
+        # Membership of every token ID in every category
+        self.membership = np.zeros((self.separator_id + 1, len(self.categories)), dtype=bool)
+        for column, words in enumerate(categories.values()):
+            self.membership[[self.vocabulary[word] for word in words], column] = True
+
+    def prepare(self, sentence_list):
+        """Lowercase the batch as one string and drop ignored phrases; returns the joined text."""
+        text = SEPARATOR.join(sentence_list).lower()
+        return self.ignore.sub('', text) if self.ignore else text
+
+    def flags(self, sentence_list, text=None):
+        """
+        Find the categories used by every sentence.
+
+        Parameters:
+            sentence_list (list): Sentences to match.
+            text (str): The batch as returned by prepare(), if it was already computed.
+
+        Returns:
+            np.ndarray: Boolean (sentences x categories) array.
+        """
+        if text is None:
+            text = self.prepare(sentence_list)
+
+        # Plain string replacement and splitting run in C, unlike a tokenizing regex
+        for delimiter in self.delimiters:
+            text = text.replace(delimiter, ' ')
+        tokens = text.replace(SEPARATOR, f" {SEPARATOR} ").split()
+
+        ids = np.array([self.vocabulary.get(token, 0) for token in tokens], dtype=np.int64)
+        separators = ids == self.separator_id
+        sentence_ids = np.cumsum(separators)[~separators]
+        ids = ids[~separators]
+
+        flags = np.zeros((len(sentence_list), len(self.categories)), dtype=bool)
+        rows, columns = np.nonzero(self.membership[ids])
+        flags[sentence_ids[rows], columns] = True
+        return flags
+
+    def classify(self, sentence_list, default=None, text=None):
+        """Return the highest-priority category of every sentence, or default if none matches."""
+        flags = self.flags(sentence_list, text)
+        labels = np.array(self.categories + [default], dtype=object)
+        first = np.where(flags.any(axis=1), flags.argmax(axis=1), len(self.categories))
+        return labels[first].tolist()
+
+
+NARRATIVE_ENGINE = LexiconEngine(NARRATIVE_LEXICON, delimiters="',", ignore=r"(?:you know)|(?:i'm like)")
+QUESTION_ENGINE = LexiconEngine(QUESTION_LEXICON)
@@ -0,0 +1,106 @@
+"""
+Marc St. Pierre 10/18/2026
+This module analyzes a negotiation while it is still going on. Turns are appended as they
+finish and only the new sentences are embedded and scored against the meeting so far.
+"""
+
+import numpy as np
+
+import model_registry
+import parameterizer
+
+
+class LiveParameterizer:
+    """
+    Incremental counterpart of parameterizer.parameterize.
+
+    Every record only depends on the sentences before it, so records are final as soon as
+    their turn is appended. Appending k new sentences to a meeting of n sentences costs
+    O(k * n) similarity work instead of recomputing the full n x n matrix.
+
+    Parameters:
+        batch_size (int): Batch size for sentiment and embedding inference.
+        keep_similarities (bool): Keep the similarity rows of every sentence (the lower
+                                  triangle of the full matrix, O(n^2) memory) for
+                                  similarity_matrix(). Off by default for long meetings.
+        topic_list (list): Topics to assign sentences to (see parameterizer.match_topic).
+    """
+
+    def __init__(self, batch_size=32, keep_similarities=False, topic_list=None):
+        self.batch_size = batch_size
+        self.keep_similarities = keep_similarities
+        self.topic_list = topic_list
+        self.records = []
+        self.sentences = []
+        self.turn_count = 0
+        self.last_speaker = " "
+        self._turns = []
+        self._embeddings = None
+        self._similarity_rows = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def append_turns(self, speaker_list, time_list, transcript_list):
+        """
+        Add finished turns (same lists as parameterize) and score their sentences.
+
+        Each call adds new turns, even when a speaker continues after their own turn.
+
+        Returns:
+            list: The new, finished records.
+        """
+        records, sentence_list = parameterizer.sentence_records(
+            speaker_list, time_list, transcript_list,
+            first_id=len(self.records), first_turn=self.turn_count, previous_speaker=self.last_speaker
+        )
+        self.turn_count += len(speaker_list)
+        if speaker_list:
+            self.last_speaker = speaker_list[-1]
+        if not records:
+            return []
+
+        emotions = parameterizer.affect_batch_detector(sentence_list, self.batch_size)
+        for data, emotion in zip(records, emotions):
+            data['emotion'], data['emotionConfidence'] = emotion
+
+        # Grow the similarity matrix by the rows of the new sentences only
+        sentence_pipeline = model_registry.get_model("sentence")
+        new_embeddings = parameterizer.sentence_encoder(sentence_list, self.batch_size)
+        if self._embeddings is None:
+            self._embeddings = new_embeddings
+        else:
+            self._embeddings = np.concatenate([self._embeddings, new_embeddings])
+        topics = parameterizer.match_topic(sentence_list, self.topic_list, new_embeddings)
+        for data, topic in zip(records, topics):
+            data['topic'], data['topicConfidence'] = topic
+
+        new_rows = np.asarray(
+            sentence_pipeline.similarity(new_embeddings, self._embeddings), dtype=np.float32
+        )
+
+        self._turns.extend(data['turn'] for data in records)
+        windows = parameterizer.turn_windows(self._turns)
+        parameterizer.similarity_block_scorer(records, new_rows, len(self.records), windows)
+
+        if self.keep_similarities:
+            self._similarity_rows.append(new_rows)
+        self.records.extend(records)
+        self.sentences.extend(sentence_list)
+        return records
+
+    def append_turn(self, speaker, time, transcript):
+        """Add a single finished turn. Returns its new records."""
+        return self.append_turns([speaker], [time], [transcript])
+
+    def similarity_matrix(self):
+        """Assemble the lower-triangular similarity matrix of the sentences so far."""
+        if not self.keep_similarities:
+            raise ValueError("Similarity rows are not kept; create the analyzer with keep_similarities=True.")
+
+        matrix = np.zeros((len(self.records), len(self.records)), dtype=np.float32)
+        row = 0
+        for rows in self._similarity_rows:
+            matrix[row:row + len(rows), :rows.shape[1]] = rows
+            row += len(rows)
+        return np.tril(matrix)
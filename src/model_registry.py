@@ -0,0 +1,227 @@
+"""
+Marc St. Pierre 10/18/2026
+This module provides a shared registry for the AI models used by the analyzer. Models are
+loaded on first use, reused after that, and evicted least-recently-used first when the
+registry grows past its memory budget.
+"""
+
+import gc
+import glob
+import os
+import threading
+from collections import OrderedDict
+
+# Default ceiling (in megabytes) on the approximate size of all loaded models
+DEFAULT_MEMORY_BUDGET_MB = 2048
+
+SENTIMENT_MODEL = "cardiffnlp/twitter-roberta-base-sentiment-latest"
+SENTENCE_MODEL = "all-MiniLM-L6-v2"
+
+# Inference backends of the sentiment and sentence models: PyTorch fp32, or ONNX Runtime
+# running graphs exported once and dynamically quantized to int8
+BACKENDS = ("torch", "onnx")
+ONNX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "negotiations-analyzer", "onnx")
+# Instruction set targeted by the int8 kernels: 'avx2', 'avx512', 'avx512_vnni' or 'arm64'
+ONNX_QUANTIZATION = "avx2"
+
+_lock = threading.RLock()
+_loaders = {}
+_models = OrderedDict()
+_memory_budget_mb = DEFAULT_MEMORY_BUDGET_MB
+_backend = "torch"
+_onnx_threads = (0, 0)
+
+
+# Model loaders (heavy libraries are imported here so importing this module stays cheap)
+def _load_sentiment():
+    from transformers import pipeline
+    return pipeline("sentiment-analysis", model=SENTIMENT_MODEL)
+
+
+def _load_sentence():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(SENTENCE_MODEL)
+
+
+def _onnx_session_options():
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    # 0 lets ONNX Runtime pick the number of threads
+    options.intra_op_num_threads, options.inter_op_num_threads = _onnx_threads
+    return options
+
+
+def _load_onnx_sentiment():
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer, pipeline
+
+    path = os.path.join(ONNX_CACHE_DIR, SENTIMENT_MODEL.replace("/", "__"))
+    if not os.path.exists(os.path.join(path, "model_quantized.onnx")):
+        # Export and quantize once; later loads read the int8 graph from disk
+        ORTModelForSequenceClassification.from_pretrained(SENTIMENT_MODEL, export=True).save_pretrained(path)
+        AutoTokenizer.from_pretrained(SENTIMENT_MODEL).save_pretrained(path)
+        quantization = getattr(AutoQuantizationConfig, ONNX_QUANTIZATION)(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(path).quantize(save_dir=path, quantization_config=quantization)
+
+    model = ORTModelForSequenceClassification.from_pretrained(
+        path, file_name="model_quantized.onnx", session_options=_onnx_session_options()
+    )
+    return pipeline("sentiment-analysis", model=model, tokenizer=AutoTokenizer.from_pretrained(path))
+
+
+def _quantized_sentence_file(path):
+    # The weight type in the name depends on the target, e.g. 'model_quint8_avx2.onnx'
+    files = glob.glob(os.path.join(path, "onnx", f"model_*int8_{ONNX_QUANTIZATION}.onnx"))
+    return os.path.relpath(files[0], path) if files else None
+
+
+def _load_onnx_sentence():
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    path = os.path.join(ONNX_CACHE_DIR, SENTENCE_MODEL.replace("/", "__"))
+    file_name = _quantized_sentence_file(path)
+    if file_name is None:
+        model = SentenceTransformer(SENTENCE_MODEL, backend="onnx")
+        model.save_pretrained(path)
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, path)
+        file_name = _quantized_sentence_file(path)
+
+    return SentenceTransformer(
+        path, backend="onnx",
+        model_kwargs={"file_name": file_name, "provider": "CPUExecutionProvider",
+                      "session_options": _onnx_session_options()}
+    )
+
+
+def _load_summarizer():
+    from transformers import pipeline
+    return pipeline("summarization", model="facebook/bart-large-cnn")
+
+
+def _load_tagger():
+    import spacy
+    return spacy.load("en_core_web_sm")
+
+
+# Registry functions
+def register_model(name, loader, size_mb=0):
+    """Register (or replace) the loader of a named model. A loaded instance is dropped."""
+    with _lock:
+        _loaders[name] = (loader, size_mb)
+        _models.pop(name, None)
+
+
+def get_model(name):
+    """Return the named model, loading it on first use."""
+    with _lock:
+        if name in _models:
+            _models.move_to_end(name)
+            return _models[name]
+
+        if name not in _loaders:
+            raise KeyError(f"Unknown model '{name}'. Registered models: {sorted(_loaders)}")
+
+        loader, _ = _loaders[name]
+        model = loader()
+        _models[name] = model
+        _evict_to_budget(keep=name)
+        return model
+
+
+def warm_up(names=None):
+    """Load the given models (all registered models by default) ahead of first use."""
+    for name in (names if names is not None else list(_loaders)):
+        get_model(name)
+
+
+def evict_model(name):
+    """Drop a loaded model so its memory can be reclaimed. Returns True if it was loaded."""
+    with _lock:
+        evicted = _models.pop(name, None) is not None
+    if evicted:
+        gc.collect()
+    return evicted
+
+
+def loaded_models():
+    """List the names of loaded models, least recently used first."""
+    with _lock:
+        return list(_models)
+
+
+def loaded_size_mb():
+    """Sum the approximate size of the loaded models in megabytes."""
+    with _lock:
+        return sum(_loaders[name][1] for name in _models)
+
+
+def set_memory_budget(budget_mb):
+    """Set the memory budget in megabytes and evict models until the registry fits."""
+    global _memory_budget_mb
+    with _lock:
+        _memory_budget_mb = budget_mb
+        _evict_to_budget()
+
+
+def set_backend(backend, intra_op_threads=0, inter_op_threads=0):
+    """
+    Select the inference backend of the sentiment and sentence models.
+
+    Parameters:
+        backend (str): 'torch' (fp32) or 'onnx' (int8 ONNX Runtime, exported on first use).
+        intra_op_threads (int): ONNX Runtime threads within an operator (0 = automatic).
+        inter_op_threads (int): ONNX Runtime threads across operators (0 = automatic).
+    """
+    global _backend, _onnx_threads
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Use one of {BACKENDS}.")
+
+    with _lock:
+        _backend = backend
+        _onnx_threads = (intra_op_threads, inter_op_threads)
+        for name, (loader, size_mb) in _BACKEND_LOADERS.items():
+            register_model(name, loader[backend], size_mb[backend])
+    gc.collect()
+
+
+def get_backend():
+    """Return the name of the selected inference backend."""
+    return _backend
+
+
+def model_id(name):
+    """Identify the weights behind a model, including its backend, e.g. for cache keys."""
+    model_name = {"sentiment": SENTIMENT_MODEL, "sentence": SENTENCE_MODEL}[name]
+    return model_name if _backend == "torch" else f"{model_name}@onnx-int8-{ONNX_QUANTIZATION}"
+
+
+def load_with_backend(name, backend):
+    """Load a separate instance of the sentiment or sentence model with a backend, bypassing the registry."""
+    return _BACKEND_LOADERS[name][0][backend]()
+
+
+def _evict_to_budget(keep=None):
+    """Evict least recently used models until the loaded size fits in the budget."""
+    evicted = False
+    while loaded_size_mb() > _memory_budget_mb:
+        candidates = [name for name in _models if name != keep]
+        if not candidates:
+            break
+        _models.pop(candidates[0])
+        evicted = True
+    if evicted:
+        gc.collect()
+
+
+# Loaders and approximate sizes per backend of the models that support both
+_BACKEND_LOADERS = {
+    "sentiment": ({"torch": _load_sentiment, "onnx": _load_onnx_sentiment}, {"torch": 500, "onnx": 125}),
+    "sentence": ({"torch": _load_sentence, "onnx": _load_onnx_sentence}, {"torch": 90, "onnx": 25}),
+}
+
+register_model("sentiment", _load_sentiment, size_mb=500)
+register_model("sentence", _load_sentence, size_mb=90)
+register_model("summarizer", _load_summarizer, size_mb=1630)
+register_model("tagger", _load_tagger, size_mb=50)
@@ -3,18 +3,28 @@ Marc St. Pierre 1/13/2025
 This module contains the functions for detecting the parameters for analysis in a given transcript.
 """
 
+import os
 import re
-import spacy 
 
-from transformers import pipeline
-from scipy.signal import find_peaks
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
+from scipy.signal import find_peaks, peak_prominences
 
-#Inittialize Pipelines
-sentiment_pipeline = pipeline(
-    "sentiment-analysis", model='cardiffnlp/twitter-roberta-base-sentiment-latest'
-)
-sentence_pipeline = SentenceTransformer("all-MiniLM-L6-v2")
+import embedding_cache
+import lexicon
+import model_registry
+import profiler
+import stage_scheduler
+
+# Approximate bytes used per similarity tile cell by the scorers (scores, masks, peak buffer)
+SIMILARITY_CELL_BYTES = 32
+# Tiles thinner than this switch BLAS to matrix-vector kernels that round differently
+MIN_SIMILARITY_BLOCK_ROWS = 16
+
+# Bump whenever a change alters the records produced by parameterize, so cached results are invalidated
+PIPELINE_VERSION = 2
+
+# A sentence runs up to '.', '!' or '?'; text after the last terminator of a turn is dropped
+SENTENCE_PATTERN = re.compile(r'.*?[.!?]|(?: But )')
 
 #Helper Functions
 def speech_rate_detector(time_list, transcript_list):
@@ -31,55 +41,72 @@ def speech_rate_detector(time_list, transcript_list):
 
 def narrative_detector(sentence):
     """Categorize sentences by the predominant narrative pronoun use."""
-    sentence = sentence.lower()
-    sentence = re.sub(r'(?:you know)|(?:i\'m like)', '', sentence)
-    words = re.split(r'(\s|\'|,)', sentence)
-    word_set = set(words)
-
-    #this configuration prioritizes third person pronoun detection followed by second, first, then passive (no pronoun)
-    #because I'm more interested to know when people are talking about other people 
-    if word_set.intersection(
-        {
-            'he', 'him', 'his', 'she', 'her', 'hers', 'they', 'them', 'their', 'theirs',
-            'themself', 'themselves', 'herself', 'himself'
-        }
-    ):
-        return "third"
+    return narrative_batch_detector([sentence])[0]
 
-    if word_set.intersection(
-        {"you", "your", "yours", "yourself", "yourselves"}
-    ):
-        return "second"
 
-    if word_set.intersection(
-        {'i', "me", "my", "we", "our", "mine", "ours", "us", "myself", "ourselves"}
-    ):
-        return "first"
+def narrative_batch_detector(sentence_list):
+    """
+    Categorize many sentences by their predominant narrative pronoun use at once.
 
-    return "passive" if len(sentence) > 1 else ""
+    Third person pronouns take priority over second, first, then passive (no pronoun),
+    see lexicon.NARRATIVE_LEXICON.
+    """
+    text = lexicon.NARRATIVE_ENGINE.prepare(sentence_list)
+    labels = lexicon.NARRATIVE_ENGINE.classify(sentence_list, text=text)
+    lengths = [len(sentence) for sentence in text.split(lexicon.SEPARATOR)] if sentence_list else []
+    return [
+        label if label is not None else ("passive" if length > 1 else "")
+        for label, length in zip(labels, lengths)
+    ]
 
 
 def question_detector(sentence):
     """Determine whether a question is open-ended or closed-ended."""
-    if "?" in sentence:
-        words = re.split(r'(\s|\')', sentence.lower())
-        word_set = set(words)
-        if word_set.intersection({"why", "how", "what"}):
-            return "openEnded"
-        return "closedEnded"
+    return question_batch_detector([sentence])[0]
 
-    return None
+
+def question_batch_detector(sentence_list):
+    """Determine for many sentences at once whether they are open-ended, closed-ended or no questions."""
+    questions = [idx for idx, sentence in enumerate(sentence_list) if "?" in sentence]
+    labels = lexicon.QUESTION_ENGINE.classify([sentence_list[idx] for idx in questions], default="closedEnded")
+
+    output = [None] * len(sentence_list)
+    for idx, label in zip(questions, labels):
+        output[idx] = label
+    return output
 
 
 def affect_detector(sentence):
     """Compute the sentiment score of a sentence."""
+    sentiment_pipeline = model_registry.get_model("sentiment")
     sentiment = sentiment_pipeline(sentence)[0]
     return sentiment['label'], sentiment['score']
 
 
+def affect_batch_detector(sentence_list, batch_size=32):
+    """Compute the sentiment scores of many sentences in batches sorted by token length."""
+    if not sentence_list:
+        return []
+
+    sentiment_pipeline = model_registry.get_model("sentiment")
+
+    # Sorting by token length keeps sentences of similar size together so padding stays low
+    token_lengths = [len(ids) for ids in sentiment_pipeline.tokenizer(sentence_list)['input_ids']]
+    order = sorted(range(len(sentence_list)), key=lambda idx: token_lengths[idx])
+
+    results = [None] * len(sentence_list)
+    for start in range(0, len(order), batch_size):
+        batch_ids = order[start:start + batch_size]
+        batch = [sentence_list[idx] for idx in batch_ids]
+        for idx, sentiment in zip(batch_ids, sentiment_pipeline(batch, batch_size=batch_size)):
+            results[idx] = (sentiment['label'], sentiment['score'])
+
+    return results
+
+
 def summary_generator(sentence):
     """Generate a summary using a pre-trained summarization model. does not work well for conversational data"""
-    summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
+    summarizer = model_registry.get_model("summarizer")
     summary = summarizer(
         sentence,
         max_length=100,
@@ -91,133 +118,429 @@ def summary_generator(sentence):
 
 def sentence_tagger(sentence):
     """Tag sentences with parts of speech."""
-    nlp = spacy.load("en_core_web_sm")
+    import spacy
+
+    nlp = model_registry.get_model("tagger")
     data = nlp(sentence)
     return [(token.text, token.pos_, spacy.explain(token.pos_)) for token in data]
 
 
-def similarity_detector(sentence_list):
-    """Calculate similarity scores between sentences."""
-    embeddings = sentence_pipeline.encode(sentence_list, batch_size=32)
+def sentence_encoder(sentence_list, batch_size=32):
+    """Embed sentences, encoding only those missing from the embedding cache."""
+    sentence_pipeline = model_registry.get_model("sentence")
+    return embedding_cache.cached_encode(
+        lambda sentences: sentence_pipeline.encode(sentences, batch_size=batch_size),
+        model_registry.model_id("sentence"),
+        sentence_pipeline.get_sentence_embedding_dimension(),
+        sentence_list,
+    )
+
+
+def similarity_detector(sentence_list, embeddings=None):
+    """Calculate similarity scores between sentences, from their embeddings if already computed."""
+    sentence_pipeline = model_registry.get_model("sentence")
+    if embeddings is None:
+        embeddings = sentence_encoder(sentence_list)
     return sentence_pipeline.similarity(embeddings, embeddings)
 
 
-def match_topic(transcript_list, topic_list):
-    """Match transcript sentences to the most similar topic from a given list."""
-    topic_embeddings = sentence_pipeline.encode(topic_list, convert_to_tensor=True)
-    transcript_embeddings = sentence_pipeline.encode(
-        transcript_list, batch_size=32, convert_to_tensor=True
-    )
+def match_topic(transcript_list, topic_list, embeddings=None):
+    """
+    Match transcript sentences to the most similar topic from a given list.
 
-    results = []
-    for embedding in transcript_embeddings:
-        similarities = util.cos_sim(embedding, topic_embeddings)
-        max_idx = similarities.argmax().item()
-        score = similarities[0][max_idx].item()
-        results.append((topic_list[max_idx], score))
+    All sentences are scored against all topics with one matrix product of the normalized
+    embeddings. Sentence embeddings that were already computed can be passed in.
 
-    return results
+    Returns:
+        list: (topic, cosine similarity) of every sentence, or (None, None) without topics.
+    """
+    if not topic_list or not transcript_list:
+        return [(None, None)] * len(transcript_list)
 
+    if embeddings is None:
+        embeddings = sentence_encoder(transcript_list)
+    topic_embeddings = sentence_encoder(topic_list)
+
+    def normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    similarities = normalize(embeddings) @ normalize(topic_embeddings).T
+    best = similarities.argmax(axis=1)
+    scores = similarities[np.arange(len(best)), best]
+    return [(topic_list[idx], score) for idx, score in zip(best.tolist(), scores.tolist())]
+
+
+def turn_windows(turn_list):
+    """
+    Compute, for every sentence, the id ranges of the turns it is compared against.
+
+    Sentence ids are consecutive and grouped by turn, so the previous turn, the speaker's
+    own previous turn (two turns back), the earlier part of the current turn and the
+    earlier history are all contiguous [start, end) ranges of ids.
+    """
+    turns = np.asarray(turn_list)
+    ids = np.arange(len(turns))
+
+    # Index of the group of consecutive sentences sharing a turn, and where each group starts
+    new_group = np.r_[True, turns[1:] != turns[:-1]] if len(turns) else np.zeros(0, dtype=bool)
+    group = np.cumsum(new_group) - 1
+    group_starts = np.r_[ids[new_group], len(turns)]
+
+    this_start = group_starts[group]
+    previous_start = np.where(group >= 1, group_starts[np.maximum(group - 1, 0)], this_start)
+    my_previous_start = np.where(group >= 2, group_starts[np.maximum(group - 2, 0)], previous_start)
+
+    return {
+        'this': (this_start, ids),
+        'previous': (previous_start, this_start),
+        'myPrevious': (my_previous_start, previous_start),
+        'history': (np.zeros_like(ids), my_previous_start),
+    }
+
+
+def _masked_argmax(scores, lo, hi, reverse=False):
+    """
+    Find the best column in [lo, hi) of every row of a score block.
+
+    Ties resolve to the lowest column, or the highest one when `reverse` is set. Rows with
+    an empty range get index -1.
+    """
+    columns = np.arange(scores.shape[1])
+    mask = (columns >= lo[:, None]) & (columns < hi[:, None])
+    masked = np.where(mask, scores, -np.inf)
+
+    if reverse:
+        best = scores.shape[1] - 1 - np.argmax(masked[:, ::-1], axis=1)
+    else:
+        best = np.argmax(masked, axis=1)
+
+    best = np.where(hi > lo, best, -1)
+    return best, scores[np.arange(len(scores)), np.maximum(best, 0)]
+
+
+def _block_local_maxima(block, block_start, height=0.1, prominence=0.3):
+    """
+    Find the similarity peaks of a block of rows with a single SciPy call.
+
+    Row r is searched over the scores of sentences 0..r-2, like the per-row
+    find_peaks(row[:r - 1], height, prominence) it replaces. The rows are laid end to end,
+    padded and separated by a value above any similarity, which no real peak can cross.
+
+    Returns:
+        tuple: Number of peaks per row and the concatenated peak ids of all rows.
+    """
+    rows, width = block.shape
+    lengths = np.maximum(np.arange(block_start, block_start + rows) - 1, 0)
+    separator = 2.0
+
+    padded = np.full((rows, width + 1), separator)
+    padded[:, :width] = np.where(np.arange(width) < lengths[:, None], block, separator)
+    flat = padded.ravel()
+
+    # Prominences are computed for real peaks only; separator runs would scan the whole array
+    peaks, _ = find_peaks(flat, height=height)
+    peaks = peaks[flat[peaks] != separator]
+    if len(peaks):
+        peaks = peaks[peak_prominences(flat, peaks)[0] >= prominence]
+
+    counts = np.bincount(peaks // (width + 1), minlength=rows)
+    return counts, peaks % (width + 1)
+
+
+def local_max_detector(similarity_tensors, block_size=1024, height=0.1, prominence=0.3):
+    """
+    Find, for every sentence, the earlier sentences where its similarity scores peak.
+
+    Returns:
+        tuple: CSR-style (indptr, indices) arrays; the peaks of sentence i are
+               indices[indptr[i]:indptr[i + 1]].
+    """
+    similarities = np.asarray(similarity_tensors, dtype=np.float32)
+    block_peaks = [
+        _block_local_maxima(
+            similarities[block_start:block_start + block_size, :block_start + block_size],
+            block_start, height, prominence
+        )
+        for block_start in range(0, len(similarities), block_size)
+    ]
+    return _peaks_to_csr(block_peaks)
+
+
+def _peaks_to_csr(block_peaks):
+    """Join the (counts, indices) results of consecutive row blocks into (indptr, indices)."""
+    counts = [block_counts for block_counts, _ in block_peaks]
+    indices = [block_indices for _, block_indices in block_peaks]
+    indptr = np.r_[0, np.cumsum(np.concatenate(counts))] if counts else np.zeros(1)
+    indices = np.concatenate(indices) if indices else np.zeros(0)
+    return indptr.astype(np.int64), indices.astype(np.int32)
+
+
+def similarity_block_scorer(entries, block, block_start, windows, store_peaks=True):
+    """
+    Score a block of consecutive sentences against every sentence before them.
+
+    Parameters:
+        entries (list): Records of sentences block_start .. block_start + len(block) - 1.
+        block (array): Their similarity rows, covering at least all earlier sentence ids.
+        block_start (int): Id of the first sentence in the block.
+        windows (dict): turn_windows of the whole transcript so far.
+        store_peaks (bool): Also fill in 'localMaxDistro'.
+    """
+    rows = slice(block_start, block_start + len(entries))
+    block = block[:, :rows.stop]
+
+    response_ids, response_scores = _masked_argmax(block, *[w[rows] for w in windows['previous']])
+    this_ids, this_scores = _masked_argmax(block, *[w[rows] for w in windows['this']])
+    mine_ids, mine_scores = _masked_argmax(block, *[w[rows] for w in windows['myPrevious']])
+    repeat_ids, repeat_scores = _masked_argmax(block, *[w[rows] for w in windows['history']], reverse=True)
+
+    # Earlier sentences of the current turn win ties against the speaker's previous turn
+    use_mine = (this_ids < 0) | ((mine_ids >= 0) & (mine_scores > this_scores))
+    coherence_ids = np.where(use_mine, mine_ids, this_ids)
+    coherence_scores = np.where(use_mine, mine_scores, this_scores)
+
+    if store_peaks:
+        # Calculate local maximum distribution
+        peak_counts, peak_ids = _block_local_maxima(block, block_start)
+        peak_ids = np.split(peak_ids, np.cumsum(peak_counts)[:-1])
 
-def responsiveness_coherence_detector(output, similarity_tensors):
-    """Evaluate similarity between turn-takers and their own statements."""
-    previous_turn = 0
-    my_previous_turn_ids = []
-    previous_turn_ids = []
-    this_turn_ids = []
-
-    for entry in output:
-        if entry['turn'] != previous_turn:
-            previous_turn = entry['turn']
-            my_previous_turn_ids = previous_turn_ids
-            previous_turn_ids = this_turn_ids
-            this_turn_ids = []
-
-        all_scores = similarity_tensors[entry['id']]
-
-        if previous_turn_ids:
-            # Calculate response scores
-            response_scores = [
-                (idx, float(all_scores[idx])) for idx in previous_turn_ids
-            ]
-            max_response_pair = max(response_scores, key=lambda x: x[1])
-            entry['responseID'], entry['responseScore'] = max_response_pair
-        else:
-            entry['responseID'], entry['responseScore'] = None, None
-
-        if (this_turn_ids + my_previous_turn_ids):
-            # Calculate self scores
-            self_scores = [
-                (idx, float(all_scores[idx])) for idx in (this_turn_ids + my_previous_turn_ids)
-            ]
-            max_self_pair = max(self_scores, key=lambda x: x[1])
-            entry['coherenceID'], entry['coherenceScore'] = max_self_pair
-        else:
-            entry['coherenceID'], entry['coherenceScore'] = None, None
+    for offset, entry in enumerate(entries):
+        entry['responseID'], entry['responseScore'] = _id_score(response_ids[offset], response_scores[offset])
+        entry['coherenceID'], entry['coherenceScore'] = _id_score(coherence_ids[offset], coherence_scores[offset])
 
         if entry['turn'] > 2:
-            # Calculate repetition scores
-            rep_scores = [
-                (idx, float(all_scores[idx])) for idx in range(entry['id'] - len(this_turn_ids + previous_turn_ids + my_previous_turn_ids) - 1, -1, -1)
-            ]
-            max_rep_pair = max(rep_scores, key=lambda x: x[1])
-            entry['repeatID'], entry['repeatScore'] = max_rep_pair
+            entry['repeatID'], entry['repeatScore'] = _id_score(repeat_ids[offset], repeat_scores[offset])
         else:
             entry['repeatID'], entry['repeatScore'] = None, None
 
-        this_turn_ids.append(entry['id'])
+        if store_peaks:
+            entry['localMaxDistro'] = peak_ids[offset].tolist()
+
+    return entries
+
+
+def blockwise_similarity_detector(output, sentence_list, memory_limit_mb=256, peak_format="list", embeddings=None):
+    """
+    Score all sentences tile by tile from their embeddings, without the dense n x n matrix.
+
+    Each tile holds the similarity rows of a block of sentences against the sentences up to
+    that block, is reduced right away to the response/coherence/repeat candidates and peaks,
+    and is dropped. The block height is chosen so a tile and its temporaries stay within
+    memory_limit_mb (but is at least MIN_SIMILARITY_BLOCK_ROWS). Results match the dense
+    path up to float rounding: scores can differ in the last bits, and IDs of near-tied
+    candidates can differ. Embeddings that were already computed can be passed in.
+
+    Returns:
+        list: The scored records, or (records, (indptr, indices)) with peak_format="csr".
+    """
+    sentence_pipeline = model_registry.get_model("sentence")
+    if embeddings is None:
+        embeddings = sentence_encoder(sentence_list)
+    windows = turn_windows([entry['turn'] for entry in output])
+
+    row_bytes = SIMILARITY_CELL_BYTES * max(len(output), 1)
+    block_size = max(MIN_SIMILARITY_BLOCK_ROWS, int(memory_limit_mb * 2**20 // row_bytes))
+
+    block_peaks = []
+    for block_start in range(0, len(output), block_size):
+        block_end = min(block_start + block_size, len(output))
+        tile = np.asarray(
+            sentence_pipeline.similarity(embeddings[block_start:block_end], embeddings[:block_end]),
+            dtype=np.float32
+        )
+        similarity_block_scorer(
+            output[block_start:block_end], tile, block_start, windows, peak_format == "list"
+        )
+        if peak_format == "csr":
+            block_peaks.append(_block_local_maxima(tile, block_start))
+
+    if peak_format == "csr":
+        return output, _peaks_to_csr(block_peaks)
 
-        # Calculate local maximum distribution
-        similarity_distribution = [
-            float(all_scores[idx]) for idx in range(0, entry['id'] - 1)
-        ]
-        peaks, _ = find_peaks(similarity_distribution, height=0.1, prominence=0.3)
-        entry['localMaxDistro'] = peaks.tolist()
+    return output
+
+
+def responsiveness_coherence_detector(output, similarity_tensors, block_size=1024, store_peaks=True):
+    """Evaluate similarity between turn-takers and their own statements."""
+    similarities = np.asarray(similarity_tensors, dtype=np.float32)
+    windows = turn_windows([entry['turn'] for entry in output])
+
+    # Rows are processed in blocks; a row only ever looks at earlier ids
+    for block_start in range(0, len(output), block_size):
+        block_end = min(block_start + block_size, len(output))
+        similarity_block_scorer(
+            output[block_start:block_end], similarities[block_start:block_end],
+            block_start, windows, store_peaks
+        )
 
     return output
 
 
-# Main function
-def parameterize(speaker_list, time_list, transcript_list):
-    """Extract parameters for analysis from a transcript."""
+def _id_score(idx, score):
+    """Convert a masked argmax result to JSON-friendly (id, score), or (None, None) if empty."""
+    return (int(idx), float(score)) if idx >= 0 else (None, None)
+
+
+def segment_sentences(transcript_list, nlp=None):
+    """
+    Split all turns into sentences in one pass.
+
+    Parameters:
+        transcript_list (list): Text of every turn.
+        nlp (spacy.Language): Optional spaCy pipeline with a sentencizer or parser; by default
+                              the turns are split with SENTENCE_PATTERN.
+
+    Returns:
+        dict: Flat 'text' (list of sentences), 'turn' (turn index of every sentence) and
+              'words' (word count of every sentence) arrays.
+    """
+    if nlp is not None:
+        text, turns = [], []
+        for idx, doc in enumerate(nlp.pipe(transcript_list)):
+            for sentence in doc.sents:
+                text.append(sentence.text)
+                turns.append(idx)
+        turns = np.array(turns, dtype=np.int64)
+    else:
+        # '.' never matches a newline, so one scan over the joined turns never crosses a turn boundary
+        joined = "\n".join(transcript_list)
+        matches = list(SENTENCE_PATTERN.finditer(joined))
+        text = [match.group() for match in matches]
+
+        turn_starts = np.cumsum([0] + [len(transcript) + 1 for transcript in transcript_list[:-1]])
+        starts = np.fromiter((match.start() for match in matches), dtype=np.int64, count=len(matches))
+        turns = np.searchsorted(turn_starts, starts, side='right') - 1
+
+    words = np.fromiter((len(sentence.split()) for sentence in text), dtype=np.int64, count=len(text))
+    return {'text': text, 'turn': turns, 'words': words}
+
+
+def lexical_detector(sentence_list):
+    """Detect the question and narrative types of many sentences."""
+    return question_batch_detector(sentence_list), narrative_batch_detector(sentence_list)
+
+
+def sentence_records(speaker_list, time_list, transcript_list, first_id=0, first_turn=0, previous_speaker=" ",
+                     nlp=None, lexical=True):
+    """
+    Split turns into sentences and build their records, without model-based parameters.
+
+    first_id, first_turn and previous_speaker continue the sentence ids, turn numbers and
+    'previous' speaker of turns that were processed earlier. nlp is passed on to segment_sentences.
+    With lexical=False 'qType' and 'nType' are left None for a separate lexical_detector stage.
+
+    Returns:
+        tuple: The list of records and the list of their sentences.
+    """
+    speech_rates = np.array(speech_rate_detector(time_list, transcript_list), dtype=np.int64)
+    segments = segment_sentences(transcript_list, nlp)
+
+    # Air time of every sentence at the speaking rate of its turn; sentences of a second or less are dropped
+    turns = segments['turn']
+    air_times = (segments['words'] * 60 / np.maximum(speech_rates[turns], 1)).astype(np.int64)
+    keep = np.flatnonzero(air_times > 1)
+
+    previous_list = [previous_speaker] + list(speaker_list[:-1])
+    sentence_list = [segments['text'][idx] for idx in keep]
+    questions, narratives = lexical_detector(sentence_list) if lexical else ([None] * len(keep), [None] * len(keep))
+
     output = []
-    speech_rates = speech_rate_detector(time_list, transcript_list)
-
-    sentence_list = []
-    count = 0
-
-    for idx1, speaker in enumerate(speaker_list):
-        delimiter = r'[.!?]|(?: But )'
-        pattern = f'(.*?{delimiter})'
-        transcript = re.findall(pattern, transcript_list[idx1])
-
-        for sentence in transcript:
-            time = int(len(sentence.split()) * 60 / speech_rates[idx1])
-            if time <= 1:
-                continue
-
-            sentence_list.append(sentence)
-            emotion = affect_detector(sentence)
-
-            data = {
-                'id': count,
-                'turn': idx1,
-                'name': speaker,
-                'previous': " " if idx1 == 0 else speaker_list[idx1 - 1],
-                'text': sentence,
-                'airTime': time,
-                'wpm': speech_rates[idx1],
-                'qType': question_detector(sentence),
-                'nType': narrative_detector(sentence),
-                'topic': "test",
-                'topicConfidence': 1.0,
-                'emotion': emotion[0],
-                'emotionConfidence': emotion[1],
-            }
-            count += 1
-            output.append(data)
-
-    similarities = similarity_detector(sentence_list)
-    output = responsiveness_coherence_detector(output, similarities)
+    for sentence, turn, time, question, narrative in zip(
+            sentence_list, turns[keep].tolist(), air_times[keep].tolist(), questions, narratives):
+        data = {
+            'id': first_id + len(output),
+            'turn': first_turn + turn,
+            'name': speaker_list[turn],
+            'previous': previous_list[turn],
+            'text': sentence,
+            'airTime': time,
+            'wpm': int(speech_rates[turn]),
+            'qType': question,
+            'nType': narrative,
+            'topic': None,
+            'topicConfidence': None,
+            'emotion': None,
+            'emotionConfidence': None,
+        }
+        output.append(data)
 
-    return output
+    return output, sentence_list
+
+
+# Main function
+def parameterize(speaker_list, time_list, transcript_list, batch_size=32, peak_format="list",
+                 memory_limit_mb=None, thread_budget=None, topic_list=None):
+    """
+    Extract parameters for analysis from a transcript.
+
+    With peak_format="list" every record carries its own 'localMaxDistro' list. With
+    peak_format="csr" the records omit it and (records, (indptr, indices)) is returned,
+    see local_max_detector. Setting memory_limit_mb switches to the tiled
+    blockwise_similarity_detector for transcripts too long for a dense similarity matrix.
+
+    The pipeline runs as a graph of stages (see stage_scheduler): after segmentation the
+    sentiment, embedding and lexical stages run concurrently, and similarity scoring starts
+    as soon as the embeddings are ready. thread_budget caps the cores used by all stages
+    together (all cores by default). Sentences are assigned to the closest of topic_list
+    (see match_topic) from the same embeddings; without topics 'topic' stays None.
+    """
+    cores = thread_budget or os.cpu_count() or 1
+    # The sentiment model is several times larger than the sentence model, so it gets most cores
+    sentiment_threads = max(1, (cores - 1) * 3 // 4)
+    embedding_threads = max(1, cores - 1 - sentiment_threads)
+
+    def segment():
+        profiler.count(len(transcript_list))
+        return sentence_records(speaker_list, time_list, transcript_list, lexical=False)
+
+    def sentiment(records):
+        profiler.count(len(records[1]))
+        return affect_batch_detector(records[1], batch_size)
+
+    def embed(records):
+        profiler.count(len(records[1]))
+        return sentence_encoder(records[1], batch_size)
+
+    def lexical(records):
+        profiler.count(len(records[1]))
+        return lexical_detector(records[1])
+
+    def topic(records, embeddings):
+        profiler.count(len(records[1]))
+        return match_topic(records[1], topic_list, embeddings)
+
+    def similarity(records, embeddings):
+        # Only this stage writes to the records while the others run
+        output, sentence_list = records
+        profiler.count(len(sentence_list))
+        if memory_limit_mb is not None:
+            return blockwise_similarity_detector(output, sentence_list, memory_limit_mb, peak_format, embeddings)
+
+        with profiler.stage("similarity_matrix", len(sentence_list)):
+            similarities = similarity_detector(sentence_list, embeddings)
+        with profiler.stage("response_coherence", len(sentence_list)):
+            output = responsiveness_coherence_detector(output, similarities, store_peaks=peak_format == "list")
+        if peak_format == "csr":
+            with profiler.stage("local_maxima", len(sentence_list)):
+                return output, local_max_detector(similarities)
+        return output
+
+    def assemble(records, emotions, lexical_types, topics, scored):
+        for data, emotion, question, narrative, topic_match in zip(records[0], emotions, *lexical_types, topics):
+            data['emotion'], data['emotionConfidence'] = emotion
+            data['qType'], data['nType'] = question, narrative
+            data['topic'], data['topicConfidence'] = topic_match
+        return scored
+
+    with profiler.stage("parameterize", len(transcript_list)):
+        results = stage_scheduler.run_stages([
+            stage_scheduler.Stage("segment", segment),
+            stage_scheduler.Stage("sentiment", sentiment, ["segment"], sentiment_threads),
+            stage_scheduler.Stage("embed", embed, ["segment"], embedding_threads),
+            stage_scheduler.Stage("lexical", lexical, ["segment"]),
+            stage_scheduler.Stage("similarity", similarity, ["segment", "embed"], embedding_threads),
+            stage_scheduler.Stage("topic", topic, ["segment", "embed"]),
+            stage_scheduler.Stage("assemble", assemble, ["segment", "sentiment", "lexical", "topic", "similarity"]),
+        ], cores)
+    return results["assemble"]
@@ -0,0 +1,147 @@
+"""
+Marc St. Pierre 10/18/2026
+This module records how long each stage of an analysis takes. Code marks its stages with
+profiler.stage(); while a profile is active in the current context, every stage records its
+wall time, CPU time, item count and the peak RSS of the process. Profiles can be logged as
+structured records or saved as a Chrome/Perfetto trace file.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("negotiations_analyzer.profile")
+
+_profile = contextvars.ContextVar("profile", default=None)
+_record = contextvars.ContextVar("profile_record", default=None)
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of the process in megabytes (None if unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class Profile:
+    """
+    Stage records of one analysis.
+
+    Parameters:
+        name (str): Name of the profiled work, e.g. the uploaded file name.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.records = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self):
+        """Return the records ordered by start time."""
+        with self._lock:
+            return sorted(self.records, key=lambda record: record['start'])
+
+    def log(self, level=logging.INFO):
+        """Log every record as one JSON line."""
+        for record in self.summary():
+            logger.log(level, json.dumps({'profile': self.name, **record}))
+
+    def to_trace(self):
+        """Convert the records to the Chrome trace event format (chrome://tracing, Perfetto)."""
+        events = [
+            {
+                'name': record['stage'], 'ph': 'X', 'pid': 1, 'tid': record['thread'],
+                'ts': record['start'] * 1e6, 'dur': record['wall'] * 1e6,
+                'args': {key: record[key] for key in ('cpu', 'items', 'peak_rss_mb')},
+            }
+            for record in self.summary()
+        ]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'profile': self.name}}
+
+    def save_trace(self, file_name):
+        """Write the records as a trace file."""
+        with open(file_name, "w") as trace_file:
+            json.dump(self.to_trace(), trace_file)
+
+
+@contextmanager
+def profile(name):
+    """Collect the stages run in this context (and in stage_scheduler stages started from it)."""
+    with activate(Profile(name)) as active:
+        yield active
+
+
+@contextmanager
+def activate(active):
+    """Add the stages run in this context to an existing profile (no-op for None)."""
+    token = _profile.set(active)
+    try:
+        yield active
+    finally:
+        _profile.reset(token)
+
+
+@contextmanager
+def stage(name, items=None):
+    """
+    Record one stage of the active profile; nested stages are named 'outer/inner'.
+
+    Without an active profile nothing is measured. The item count can also be set from
+    inside the stage with count().
+    """
+    active = _profile.get()
+    if active is None:
+        yield None
+        return
+
+    parent = _record.get()
+    record = {
+        'stage': f"{parent['stage']}/{name}" if parent else name,
+        'start': time.perf_counter() - active._origin,
+        'items': items,
+        'thread': threading.get_ident(),
+    }
+    token = _record.set(record)
+    cpu_started = time.process_time()
+    try:
+        yield record
+    finally:
+        _record.reset(token)
+        record['wall'] = time.perf_counter() - active._origin - record['start']
+        # CPU time of the whole process, so stages running at the same time share it
+        record['cpu'] = time.process_time() - cpu_started
+        record['peak_rss_mb'] = peak_rss_mb()
+        active.add(record)
+
+
+def count(items):
+    """Set the item count of the innermost running stage."""
+    record = _record.get()
+    if record is not None:
+        record['items'] = items
+
+
+def profiled(function):
+    """Record every call of a function taking a DataFrame first as a stage counting its rows."""
+    @functools.wraps(function)
+    def wrapper(df, *args, **kwargs):
+        with stage(function.__name__, len(df)):
+            return function(df, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,96 @@
+"""
+Marc St. Pierre 10/18/2026
+This module caches analyzed transcripts, keyed by a hash of the raw transcript content and
+everything that affects the analysis output (pipeline version, models and parameters).
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "negotiations-analyzer", "results")
+MEMORY_CACHE_SIZE = 8
+
+_lock = threading.Lock()
+_frames = OrderedDict()
+_cache_dir = DEFAULT_CACHE_DIR
+
+
+# Helper functions
+def result_key(content, **params):
+    """
+    Hash the raw transcript content together with the settings that produced its analysis.
+
+    Parameters:
+        content (str): Raw transcript content.
+        **params: Pipeline version, model names and parameters; any change yields a new key.
+
+    Returns:
+        str: Hex digest identifying the analysis result.
+    """
+    digest = hashlib.sha256(content.encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def set_cache_dir(cache_dir):
+    """Point the cache at another directory, or keep results in memory only with None."""
+    global _cache_dir
+    with _lock:
+        _cache_dir = cache_dir
+        _frames.clear()
+
+
+def _result_path(key):
+    return os.path.join(_cache_dir, f"{key}.json")
+
+
+# Main functions
+def load_result(key, variant="json"):
+    """
+    Return the cached per-sentence records and DataFrame for a key.
+
+    Parameters:
+        key (str): Key from result_key.
+        variant (str): Output the caller needs a DataFrame for, e.g. 'json' or
+                       'parquet+embeddings'. Frames read back from disk are 'json'.
+
+    Returns:
+        tuple: (records, DataFrame), or (None, None) on a cache miss. The DataFrame is None
+               when the cached one was loaded from another variant. It is a copy, so
+               callers may modify it freely; the records are shared with the cache and
+               must be treated as read-only.
+    """
+    with _lock:
+        if key not in _frames:
+            if _cache_dir is None or not os.path.exists(_result_path(key)):
+                return None, None
+            with open(_result_path(key)) as json_file:
+                data = json.load(json_file)
+            _remember(key, data, pd.read_json(_result_path(key)), "json")
+
+        _frames.move_to_end(key)
+        data, df, cached_variant = _frames[key]
+        return data, (df.copy() if cached_variant == variant else None)
+
+
+def save_result(key, data, df, variant="json"):
+    """Store the per-sentence records of an analysis and the DataFrame loaded from one output variant."""
+    with _lock:
+        if _cache_dir is not None:
+            os.makedirs(_cache_dir, exist_ok=True)
+            with open(_result_path(key) + ".tmp", "w") as json_file:
+                json.dump(data, json_file)
+            os.replace(_result_path(key) + ".tmp", _result_path(key))
+        _remember(key, data, df.copy(), variant)
+
+
+def _remember(key, data, df, variant):
+    _frames[key] = (data, df, variant)
+    _frames.move_to_end(key)
+    while len(_frames) > MEMORY_CACHE_SIZE:
+        _frames.popitem(last=False)
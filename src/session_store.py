@@ -0,0 +1,55 @@
+"""
+Marc St. Pierre 10/18/2026
+This module keeps parsed uploads on the server, keyed by a hash of the upload, so Dash
+callbacks can exchange a short key instead of re-sending and re-parsing the data.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAX_SESSIONS = 16
+
+_lock = threading.Lock()
+_datasets = OrderedDict()
+# Key -> {'upload': profile of the analysis, 'figures': profile of the last figure update}
+_profiles = {}
+
+
+def upload_key(contents):
+    """Hash the base64 contents of an upload."""
+    return hashlib.sha256(contents.encode("utf-8")).hexdigest()
+
+
+def put(key, df, profile=None):
+    """Store a parsed DataFrame and its analysis profile, evicting the least recently used upload if full."""
+    with _lock:
+        _datasets[key] = df
+        _datasets.move_to_end(key)
+        if profile is not None:
+            _profiles[key] = {'upload': profile}
+        while len(_datasets) > MAX_SESSIONS:
+            evicted, _ = _datasets.popitem(last=False)
+            _profiles.pop(evicted, None)
+
+
+def get(key):
+    """Return the DataFrame stored under key, or None if it is unknown or was evicted."""
+    with _lock:
+        if key not in _datasets:
+            return None
+        _datasets.move_to_end(key)
+        return _datasets[key]
+
+
+def put_profile(key, profile, part="upload"):
+    """Store a profiler.Profile of a stored upload, replacing the previous one of that part."""
+    with _lock:
+        if key in _datasets:
+            _profiles.setdefault(key, {})[part] = profile
+
+
+def get_profile(key, part="upload"):
+    """Return a profiler.Profile of an upload ('upload' or 'figures'), or None."""
+    with _lock:
+        return _profiles.get(key, {}).get(part)
@@ -0,0 +1,86 @@
+"""
+Marc St. Pierre 10/18/2026
+This module runs a small dependency graph of pipeline stages on a thread pool. A stage starts
+as soon as the stages it needs have finished and enough of the thread budget is free, so
+independent stages overlap without oversubscribing the cores.
+"""
+
+import contextvars
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import profiler
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    Parameters:
+        name (str): Name under which the stage's result is stored.
+        function (callable): Called with the results of the required stages, in order.
+        requires (tuple): Names of the stages whose results the function needs.
+        threads (int): Cores the stage may use; model stages size torch's intra-op pool to it.
+    """
+
+    def __init__(self, name, function, requires=(), threads=1):
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+        self.threads = threads
+
+
+def _run_stage(stage, threads, arguments):
+    # Only model stages use torch; it is not imported just to set the thread count
+    if threads > 1 and "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    with profiler.stage(stage.name):
+        return stage.function(*arguments)
+
+
+def run_stages(stages, thread_budget=None):
+    """
+    Run stages concurrently in dependency order.
+
+    Stages are started in list order whenever their requirements are met and their threads
+    fit in the unused part of the budget; a stage asking for more than the whole budget
+    gets the whole budget.
+
+    Parameters:
+        stages (list): Stage objects; names must be unique.
+        thread_budget (int): Cores shared by all running stages (defaults to all cores).
+
+    Returns:
+        dict: Result of every stage by name.
+    """
+    budget = thread_budget or os.cpu_count() or 1
+    results, running = {}, {}
+    remaining = list(stages)
+    free = budget
+
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as pool:
+        while remaining or running:
+            for stage in list(remaining):
+                threads = min(stage.threads, budget)
+                if threads <= free and all(name in results for name in stage.requires):
+                    remaining.remove(stage)
+                    free -= threads
+                    arguments = [results[name] for name in stage.requires]
+                    # Stages run in a copy of the caller's context, so they are recorded in its profile
+                    future = pool.submit(contextvars.copy_context().run, _run_stage, stage, threads, arguments)
+                    running[future] = (stage, threads)
+
+            if not running:
+                missing = {name for stage in remaining for name in stage.requires} - set(results)
+                raise ValueError(
+                    f"Stages {[stage.name for stage in remaining]} wait on missing or circular stages {sorted(missing)}"
+                )
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, threads = running.pop(future)
+                free += threads
+                results[stage.name] = future.result()
+
+    return results
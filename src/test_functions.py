@@ -3,13 +3,362 @@ Marc St. Pierre
 Testing helper functions using pytest
 """
 
+import json
+import multiprocessing
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.signal import find_peaks
+
+import analyzer
+import app
+import backend_parity
+import batch_analyzer
+import benchmark
+import embedding_cache
 import fathom_preprocessor as fpp
+import lexicon
+import live_parameterizer
+import model_registry
+import parameterizer as prm
+import profiler
+import result_cache
+import stage_scheduler
+import visualizer
 
 def test_convert_time():
     assert fpp.convert_time(['00:00', '00:15', '1:00'], 120) == [15, 45, 60]
     assert fpp.convert_time(['00:01', '00:15', '1:00'], 120) == [14, 45, 60]
     assert fpp.convert_time(['00:00', '00:00', '1:00'], 60) == [1, 60, 1]
+    assert fpp.convert_time(['59:30', '1:00:10', '1:02:03'], 3780) == [40, 113, 57]
+
+def test_iter_turns():
+    lines = iter(["Title\n", "VIEW RECORDING - 63 mins\n", "---\n", "\n", "0:00 - A B\n", "  hi at 10:30\n",
+                  "\n", "1:00:05 - C\n", "  yes\n", "  no\n"])
+    assert fpp.read_header(lines) == 3780
+    assert list(fpp.iter_turns(lines)) == [("A B", 0, "hi at 10:30"), ("C", 3605, "yes no")]
+
+    # Names may end in a digit
+    content = "Title\nVIEW RECORDING - 2 mins\n---\n" \
+        "0:00 - Speaker 1\n  Hi.\n0:30 - Speaker 2\n  Hello.\n1:00 - Anna\n  Ok then.\n"
+    assert fpp.prep_file(content, False) == \
+        [["Speaker 1", "Speaker 2", "Anna"], [30, 30, 60], ["Hi.", "Hello.", "Ok then."]]
 
 def test_process_speaker_names():
     assert fpp.process_speaker_names([" a\n\r"], False) == ["a"]
-    assert fpp.process_speaker_names(["a", "b", "a", "b"], True) == ["Speaker0", "Speaker1", "Speaker0", "Speaker1"]
\ No newline at end of file
+    assert fpp.process_speaker_names(["a", "b", "a", "b"], True) == ["Speaker0", "Speaker1", "Speaker0", "Speaker1"]
+    assert fpp.process_speaker_names(["Ann", "Anna", "Ann"], True) == ["Speaker0", "Speaker1", "Speaker0"]
+
+    speaker_map = {}
+    assert fpp.process_speaker_names(["b", "a"], True, speaker_map) == ["Speaker0", "Speaker1"]
+    assert fpp.process_speaker_names(["c", "a "], True, speaker_map) == ["Speaker2", "Speaker1"]
+    assert speaker_map == {"b": "Speaker0", "a": "Speaker1", "c": "Speaker2"}
+
+def test_segment_sentences():
+    segments = prm.segment_sentences(["One two. Three four? Five", "Six seven!"])
+    assert segments['text'] == ["One two.", " Three four?", "Six seven!"]
+    assert segments['turn'].tolist() == [0, 0, 1]
+    assert segments['words'].tolist() == [2, 2, 2]
+
+def _baseline_scores(turns, similarities):
+    # The per-sentence loop that responsiveness_coherence_detector replaced
+    records, previous_turn, my_previous_ids, previous_ids, this_ids = [], 0, [], [], []
+    for idx, turn in enumerate(turns):
+        if turn != previous_turn:
+            previous_turn, my_previous_ids, previous_ids, this_ids = turn, previous_ids, this_ids, []
+        scores = similarities[idx]
+
+        def best(ids):
+            return max(((i, float(scores[i])) for i in ids), key=lambda pair: pair[1]) if ids else (None, None)
+
+        older = range(idx - len(this_ids + previous_ids + my_previous_ids) - 1, -1, -1) if turn > 2 else []
+        records.append({
+            'id': idx, 'turn': turn,
+            'response': best(previous_ids), 'coherence': best(this_ids + my_previous_ids), 'repeat': best(older),
+            'localMaxDistro': find_peaks(scores[:max(idx - 1, 0)], height=0.1, prominence=0.3)[0].tolist(),
+        })
+        this_ids.append(idx)
+    return records
+
+def _random_similarities(rng, size, ties):
+    similarities = rng.random((size, size)).astype(np.float32)
+    # Few distinct values make ties in every window
+    return np.round(similarities, 1) if ties else similarities
+
+def test_responsiveness_coherence_parity():
+    rng = np.random.default_rng(5)
+    for trial in range(40):
+        size = int(rng.integers(1, 60))
+        # Turns start at 0, skip numbers and often hold one sentence, so windows are empty
+        turns = np.cumsum(rng.integers(0, 3, size) * (rng.random(size) < 0.6)).tolist()
+        similarities = _random_similarities(rng, size, ties=trial % 2 == 0)
+        output = prm.responsiveness_coherence_detector(
+            [{'id': idx, 'turn': turn} for idx, turn in enumerate(turns)], similarities, block_size=7)
+        scored = [
+            {'id': entry['id'], 'turn': entry['turn'], 'response': (entry['responseID'], entry['responseScore']),
+             'coherence': (entry['coherenceID'], entry['coherenceScore']),
+             'repeat': (entry['repeatID'], entry['repeatScore']), 'localMaxDistro': entry['localMaxDistro']}
+            for entry in output
+        ]
+        assert scored == _baseline_scores(turns, similarities)
+
+def test_local_max_detector(tmp_path):
+    rng = np.random.default_rng(6)
+    for trial in range(20):
+        size = int(rng.integers(1, 80))
+        similarities = _random_similarities(rng, size, ties=trial % 2 == 0)
+        # Plateaus and values equal to the height threshold
+        similarities[:, ::5] = 0.1
+        expected = [find_peaks(row[:max(idx - 1, 0)], height=0.1, prominence=0.3)[0].tolist()
+                    for idx, row in enumerate(similarities)]
+
+        indptr, indices = prm.local_max_detector(similarities, block_size=9)
+        assert [indices[indptr[idx]:indptr[idx + 1]].tolist() for idx in range(size)] == expected
+
+        # The CSR peaks match the per-record lists of the scorer
+        output = prm.responsiveness_coherence_detector(
+            [{'id': idx, 'turn': idx // 3} for idx in range(size)], similarities, block_size=9)
+        assert [entry['localMaxDistro'] for entry in output] == expected
+
+    # Saved CSR peaks load back as the per-record lists
+    similarities = _random_similarities(rng, 60, ties=False)
+    indptr, indices = prm.local_max_detector(similarities)
+    expected = [indices[indptr[idx]:indptr[idx + 1]].tolist() for idx in range(60)]
+    assert sum(map(len, expected)) > 60
+    for name in ("peaks.json", "peaks.parquet"):
+        analyzer.save_transcript([{'id': idx} for idx in range(60)], str(tmp_path / name), peaks=(indptr, indices))
+        loaded = analyzer.load_transcript(str(tmp_path / name))['localMaxDistro']
+        assert [list(peaks) for peaks in loaded] == expected
+
+def test_lexicon_engine():
+    assert prm.narrative_batch_detector(["He and I.", "You, me.", "We did.", "Done.", "you know"]) == \
+        ["third", "second", "first", "passive", ""]
+    assert prm.question_batch_detector(["Why not?", "Okay?", "What."]) == ["openEnded", "closedEnded", None]
+
+    engine = lexicon.LexiconEngine({'offer': {"offer", "propose"}, 'concern': {"worried", "concern"}})
+    assert engine.classify(["I propose a deal, but I'm worried.", "I'm worried about it.", "Fine."], default="none") == \
+        ["offer", "concern", "none"]
+
+def test_embedding_cache_shared(tmp_path):
+    # Two caches on the same files stand in for two worker processes
+    vectors = {f"s{i}": [float(i)] * 4 for i in range(4)}
+    first = embedding_cache.EmbeddingCache(str(tmp_path), "model", 4, max_entries=3)
+    second = embedding_cache.EmbeddingCache(str(tmp_path), "model", 4, max_entries=3)
+    first.store(["s0", "s1"], [vectors["s0"], vectors["s1"]])
+    second.store(["s2", "s3"], [vectors["s2"], vectors["s3"]])
+
+    embeddings, missing = first.lookup(list(vectors))
+    assert missing == [0]
+    assert embeddings[1:, 0].tolist() == [1.0, 2.0, 3.0]
+    assert len(embedding_cache.EmbeddingCache(str(tmp_path), "model", 4, max_entries=3)) == 3
+
+def _embedding_cache_worker(cache_dir, worker):
+    # Embeddings are derived from the text, so a wrong row is detectable
+    cache = embedding_cache.EmbeddingCache(cache_dir, "model", 4, max_entries=20)
+    wrong = 0
+    for step in range(150):
+        sentences = [f"s{(worker * 7 + step * 3 + offset) % 60}" for offset in range(4)]
+        embeddings, missing = cache.lookup(sentences)
+        wrong += sum(embeddings[idx, 0] != zlib.crc32(sentence.encode()) % 1000
+                     for idx, sentence in enumerate(sentences) if idx not in missing)
+        new = [sentences[idx] for idx in missing]
+        cache.store(new, [[zlib.crc32(sentence.encode()) % 1000] * 4 for sentence in new])
+    return wrong
+
+def test_embedding_cache_processes(tmp_path, monkeypatch):
+    # Compacting after a few records makes other processes read replaced logs often
+    monkeypatch.setattr(embedding_cache, "INDEX_COMPACT_MIN", 4)
+    with multiprocessing.get_context("fork").Pool(6) as pool:
+        assert pool.starmap(_embedding_cache_worker, [(str(tmp_path), worker) for worker in range(6)]) == [0] * 6
+
+def test_run_stages():
+    stages = [
+        stage_scheduler.Stage("total", lambda a, b: a + b, ["double", "square"]),
+        stage_scheduler.Stage("double", lambda x: 2 * x, ["base"], threads=3),
+        stage_scheduler.Stage("square", lambda x: x * x, ["base"], threads=3),
+        stage_scheduler.Stage("base", lambda: 3),
+    ]
+    assert stage_scheduler.run_stages(stages, thread_budget=4) == {"base": 3, "double": 6, "square": 9, "total": 15}
+
+def test_load_topics(tmp_path):
+    mandate = tmp_path / "mandate.md"
+    mandate.write_text("# Brief\n- not a topic\n\n## Topics\nIntro.\n- algae\n* fishing rights \n# Notes\n- other\n")
+    assert analyzer.load_topics(str(mandate)) == ["algae", "fishing rights"]
+
+def test_generate_transcript():
+    content = benchmark.generate_transcript(turns=40, speakers=3, seed=1)
+    speakers, timespans, transcripts = fpp.prep_file(content, False)
+    assert len(speakers) == len(timespans) == len(transcripts) == 40
+    assert set(speakers) == {"Speaker 1", "Speaker 2", "Speaker 3"}
+    assert all(a != b for a, b in zip(speakers, speakers[1:]))
+    assert content == benchmark.generate_transcript(turns=40, speakers=3, seed=1)
+    speakers = fpp.prep_file(benchmark.generate_transcript(turns=60, speakers=30, seed=1), False)[0]
+    assert len(speakers) == 60 and any(name[-2:].isdigit() for name in speakers)
+
+def test_profiler():
+    with profiler.stage("ignored"):
+        profiler.count(1)
+
+    with profiler.profile("test") as active:
+        with profiler.stage("outer", 2):
+            stage_scheduler.run_stages([stage_scheduler.Stage("inner", lambda: profiler.count(5))])
+    assert [(record['stage'], record['items']) for record in active.summary()] == [("outer", 2), ("outer/inner", 5)]
+    assert [event['name'] for event in active.to_trace()['traceEvents']] == ["outer", "outer/inner"]
+
+def test_analyze_transcript_replaces_stale_output(tmp_path):
+    content = benchmark.generate_transcript(turns=4, seed=2)
+    data = [{'id': 0, 'name': 'Speaker A', 'text': 'Hello.'}]
+    result_cache.set_cache_dir(None)
+    try:
+        result_cache.save_result(analyzer.analysis_key(content, topic_list=[]), data, pd.DataFrame(data))
+        output = tmp_path / "meeting.json"
+        output.write_text('[{"id": 0, "name": "Other", "text": "Another transcript."}]')
+        analyzer.analyze_transcript(content, str(tmp_path / "meeting.txt"), topic_list=[])
+        assert json.loads(output.read_text()) == data
+    finally:
+        result_cache.set_cache_dir(result_cache.DEFAULT_CACHE_DIR)
+
+def test_output_path_keeps_folders(tmp_path):
+    paths = [str(tmp_path / "round1" / "meeting.txt"), str(tmp_path / "round2" / "meeting.txt")]
+    root = batch_analyzer.input_root(paths)
+    assert [batch_analyzer.output_path("out", path, "json", root) for path in paths] == \
+        [os.path.join("out", "round1", "meeting.json"), os.path.join("out", "round2", "meeting.json")]
+
+def test_plots_of_empty_selection():
+    sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "samples", "demo_transcript.json")
+    empty = analyzer.load_transcript(sample).iloc[0:0]
+    assert visualizer.plot_frequency_response_and_coherence(empty, {}).data == ()
+    assert visualizer.plot_repetition(empty, {}).data == ()
+
+def test_query_frame_orders_labels():
+    df = analyzer.apply_schema(pd.DataFrame({'id': [0, 1, 2], 'name': ["A", "S", "Z"]}))
+    assert app.query_frame(df, '{name} > A')['id'].tolist() == [1, 2]
+    assert app.query_frame(df, '{name} >= "S" && {id} < 2')['id'].tolist() == [1]
+    assert app.query_frame(df, '{id} > "x"')['id'].tolist() == [0, 1, 2]
+
+def test_onnx_backend_parity(tmp_path, monkeypatch):
+    pytest.importorskip("optimum.onnxruntime")
+    import torch
+    import transformers
+    from sentence_transformers import SentenceTransformer, models
+
+    # Tiny random models saved locally stand in for the downloaded ones
+    words = "we agree the deal is fair no not a bad offer for our elders".split()
+    (tmp_path / "vocab.txt").write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+    tokenizer = transformers.BertTokenizerFast(str(tmp_path / "vocab.txt"))
+    config = transformers.BertConfig(vocab_size=5 + len(words), hidden_size=32, num_hidden_layers=2,
+                                     num_attention_heads=2, intermediate_size=64, num_labels=3,
+                                     id2label={0: "negative", 1: "neutral", 2: "positive"})
+    torch.manual_seed(0)
+    classifier = transformers.BertForSequenceClassification(config)
+    with torch.no_grad():
+        classifier.classifier.bias.copy_(torch.tensor([0.0, 1.0, 0.0]))
+    classifier.save_pretrained(tmp_path / "sentiment")
+    tokenizer.save_pretrained(tmp_path / "sentiment")
+    transformers.BertModel(config).save_pretrained(tmp_path / "encoder")
+    tokenizer.save_pretrained(tmp_path / "encoder")
+    SentenceTransformer(modules=[models.Transformer(str(tmp_path / "encoder")), models.Pooling(32)]).save(
+        str(tmp_path / "sentence"))
+
+    monkeypatch.setattr(model_registry, "SENTIMENT_MODEL", str(tmp_path / "sentiment"))
+    monkeypatch.setattr(model_registry, "SENTENCE_MODEL", str(tmp_path / "sentence"))
+    monkeypatch.setattr(model_registry, "ONNX_CACHE_DIR", str(tmp_path / "onnx"))
+
+    sentences = ["We agree the deal is fair.", "No, not a bad offer.", "Our elders agree.", "Fair for our elders?"]
+    reference = backend_parity.run_backend("torch", sentences)
+    candidate = backend_parity.run_backend("onnx", sentences)
+    assert candidate['labels'] == reference['labels'] == ["neutral"] * 4
+    assert abs(candidate['similarities'] - reference['similarities']).mean() <= backend_parity.MAX_SIMILARITY_ERROR
+
+@pytest.fixture
+def stub_models():
+    benchmark.install_stub_models()
+    yield
+    model_registry.set_backend(model_registry.get_backend())
+    embedding_cache.set_cache_dir(embedding_cache.DEFAULT_CACHE_DIR)
+
+def test_live_parameterizer_matches_parameterize(stub_models):
+    speakers, timespans, transcripts = fpp.prep_file(benchmark.generate_transcript(turns=30, seed=3), False)
+    expected = prm.parameterize(speakers, timespans, transcripts)
+    live = live_parameterizer.LiveParameterizer(batch_size=8)
+    start = 0
+    for size in [1, 4, 2, 7, 1, 3, 5, 7]:
+        live.append_turns(speakers[start:start + size], timespans[start:start + size], transcripts[start:start + size])
+        start += size
+
+    assert start == len(speakers) and len(live.records) == len(expected)
+    score_columns = ('responseScore', 'coherenceScore', 'repeatScore')
+    for record, reference in zip(live.records, expected):
+        assert {key: value for key, value in record.items() if key not in score_columns} == \
+            {key: value for key, value in reference.items() if key not in score_columns}
+        for column in score_columns:
+            assert record[column] == pytest.approx(reference[column], abs=1e-5)
+
+def test_match_topic(stub_models, monkeypatch):
+    sentences = ["we need more algae", "the fishing rights are ours", "let us break for lunch", "algae prices"]
+    topics = ["algae", "fishing rights", "schedule"]
+    embeddings = prm.sentence_encoder(sentences)
+    topic_embeddings = prm.sentence_encoder(topics)
+    expected = []
+    for vector in embeddings:
+        scores = [np.dot(vector, topic) / (np.linalg.norm(vector) * np.linalg.norm(topic)) for topic in topic_embeddings]
+        expected.append((topics[int(np.argmax(scores))], max(scores)))
+
+    encoded = []
+    encoder = prm.sentence_encoder
+    monkeypatch.setattr(prm, "sentence_encoder", lambda sentence_list: encoded.append(list(sentence_list)) or encoder(sentence_list))
+    matches = prm.match_topic(sentences, topics)
+    assert encoded == [sentences, topics]
+    assert [topic for topic, _ in matches] == [topic for topic, _ in expected]
+    assert [score for _, score in matches] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+    # Passed-in embeddings are used as they are: only the topics are encoded
+    encoded.clear()
+    assert [topic for topic, _ in prm.match_topic(sentences[:3], topics, embeddings=topic_embeddings)] == topics
+    assert encoded == [topics]
+
+    encoded.clear()
+    assert prm.match_topic(sentences, []) == [(None, None)] * len(sentences)
+    assert prm.match_topic(sentences, None) == [(None, None)] * len(sentences)
+    assert prm.match_topic([], topics) == [] and encoded == []
+
+def test_default_topics(tmp_path, monkeypatch):
+    assert analyzer.default_topics() is None
+    mandate = tmp_path / "mandate.md"
+    mandate.write_text("# Topics\n- algae\n")
+    monkeypatch.setattr(analyzer, "TOPIC_FILE", str(mandate))
+    assert analyzer.default_topics() == ["algae"]
+
+@pytest.mark.parametrize("sample", ["demo_transcript.txt", "d_b_12-10-2024.txt"])
+def test_blockwise_similarity_matches_dense(sample, stub_models):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "samples", sample)
+    with open(path, encoding="utf-8") as transcript_file:
+        speakers, timespans, transcripts = fpp.prep_file(transcript_file, False)
+    dense = prm.parameterize(speakers, timespans, transcripts)
+    # A tiny memory limit gives tiles of MIN_SIMILARITY_BLOCK_ROWS rows
+    tiled = prm.parameterize(speakers, timespans, transcripts, memory_limit_mb=0)
+
+    assert len(tiled) == len(dense) > prm.MIN_SIMILARITY_BLOCK_ROWS
+    for tiled_record, dense_record in zip(tiled, dense):
+        for kind in ('response', 'coherence', 'repeat'):
+            assert tiled_record[kind + 'ID'] == dense_record[kind + 'ID']
+            assert tiled_record[kind + 'Score'] == pytest.approx(dense_record[kind + 'Score'], abs=1e-5)
+        assert tiled_record['localMaxDistro'] == dense_record['localMaxDistro']
+
+def test_analyze_transcript_frame_follows_output(tmp_path, stub_models):
+    content = benchmark.generate_transcript(turns=12, seed=4)
+    result_cache.set_cache_dir(None)
+    try:
+        first = analyzer.analyze_transcript(content, str(tmp_path / "meeting.txt"), topic_list=[])
+        columnar = analyzer.analyze_transcript(content, str(tmp_path / "meeting.txt"), topic_list=[],
+                                               output_format="parquet", store_embeddings=True)
+        again = analyzer.analyze_transcript(content, str(tmp_path / "meeting.txt"), topic_list=[])
+    finally:
+        result_cache.set_cache_dir(result_cache.DEFAULT_CACHE_DIR)
+
+    assert 'embedding' in columnar.columns and 'embedding' not in again.columns
+    assert list(again.columns) == list(first.columns)
+    assert isinstance(again['localMaxDistro'][0], list)
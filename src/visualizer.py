@@ -4,13 +4,122 @@ This module contains functions to generate the plots that display conversational
 """
 
 import numpy as np
+import pandas as pd
 from sklearn.linear_model import LinearRegression
 
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.subplots as sp
 
+import profiler
 
+
+# Boundaries between the response/coherence clusters
+X_BOUNDARY, Y_BOUNDARY = 0.35, 0.35
+
+# Large-data rendering: scatter plots switch to WebGL above WEBGL_THRESHOLD points and
+# ID-indexed bar charts are aggregated to at most MAX_BARS bars (about one per 2 pixels)
+WEBGL_THRESHOLD = 2000
+MAX_BARS = 600
+
+
+def classify_quadrants(coherence, response):
+    """
+    Classify coherence-response score pairs into the four negotiation clusters.
+
+    Pairs with a missing score fall through to 'Integrative', as with row-wise classification.
+    """
+    coherence = np.asarray(coherence, dtype=float)
+    response = np.asarray(response, dtype=float)
+    return np.select(
+        [
+            (coherence < X_BOUNDARY) & (response > Y_BOUNDARY),
+            coherence < X_BOUNDARY,
+            response <= Y_BOUNDARY,
+        ],
+        ['Accommodating', 'Discontinuous', 'Directive'],
+        default='Integrative'
+    )
+
+
+@profiler.profiled
+def summarize(df):
+    """
+    Compute the aggregates behind the app figures in one pass over the data.
+
+    The input DataFrame is not modified.
+
+    Parameters:
+        df (pd.DataFrame): DataFrame containing the data.
+
+    Returns:
+        dict: 'clusters' (count, proportion and mean boundary distance per name and cluster),
+              'response', 'coherence' and 'repeat' (score sums per name and ID) and 'maxId'.
+    """
+    coherence = df['coherenceScore'].to_numpy(dtype=float, na_value=np.nan)
+    response = df['responseScore'].to_numpy(dtype=float, na_value=np.nan)
+    points = pd.DataFrame({
+        'name': df['name'].to_numpy(),
+        'cluster': classify_quadrants(coherence, response),
+        'distance_to_boundary': np.sqrt((coherence - X_BOUNDARY) ** 2 + (response - Y_BOUNDARY) ** 2),
+    })
+
+    clusters = (
+        points.groupby(['name', 'cluster'], observed=True)['distance_to_boundary']
+        .agg(['size', 'mean']).reset_index()
+        .rename(columns={'size': 'count', 'mean': 'distance_to_boundary'})
+    )
+    clusters['proportion'] = (
+        clusters['count'] / clusters.groupby('name', observed=True)['count'].transform('sum') * 100
+    )
+
+    def score_sums(id_col, score_col, sum_col):
+        return df.groupby(["name", id_col], observed=True)[score_col].sum().reset_index(name=sum_col)
+
+    coherence_sums = score_sums("coherenceID", "coherenceScore", "cohScoreSum")
+    coherence_sums['cohScoreSum'] *= -1
+
+    return {
+        'clusters': clusters,
+        'response': score_sums("responseID", "responseScore", "resScoreSum"),
+        'coherence': coherence_sums,
+        'repeat': score_sums("repeatID", "repeatScore", "repScoreSum"),
+        'maxId': df['id'].max(),
+    }
+
+
+def bin_scores(data, id_col, x_range, max_bars=MAX_BARS):
+    """
+    Aggregate score sums indexed by ID into at most max_bars bins inside x_range.
+
+    Parameters:
+        data (pd.DataFrame): Score sums with 'name', id_col and one score column.
+        id_col (str): Name of the ID column.
+        x_range (list): Visible [first, last] ID, or None to keep all data unbinned.
+        max_bars (int): Maximum number of bars per speaker.
+
+    Returns:
+        tuple: The (possibly binned) data, with id_col holding bin centers, and the bin width.
+    """
+    if x_range is None:
+        return data, 1
+
+    first, last = x_range
+    data = data[(data[id_col] >= first) & (data[id_col] <= last)]
+    bin_width = int(np.ceil((last - first + 1) / max_bars))
+    if bin_width <= 1:
+        return data, 1
+
+    score_col = data.columns[2]
+    bin_start = first + (data[id_col] - first) // bin_width * bin_width
+    binned = (
+        data.assign(**{id_col: bin_start + (bin_width - 1) / 2})
+        .groupby(['name', id_col], observed=True)[score_col].sum().reset_index()
+    )
+    return binned, bin_width
+
+
+@profiler.profiled
 def plot_wpma_air_time(df, legend):
     """
     Plots two graphs:
@@ -29,10 +138,9 @@ def plot_wpma_air_time(df, legend):
         )
     )
 
-    name_list = df["name"].unique()
+    groups = list(df.groupby("name", observed=True, sort=False))
 
-    for name in name_list:
-        filtered_data = df[df["name"] == name]
+    for name, filtered_data in groups:
         fig.add_trace(
             go.Scatter(
                 x=filtered_data["id"],
@@ -44,8 +152,7 @@ def plot_wpma_air_time(df, legend):
             row=1, col=1
         )
 
-    for name in name_list:
-        filtered_data = df[df["name"] == name]
+    for name, filtered_data in groups:
         fig.add_trace(
             go.Bar(
                 x=filtered_data["id"],
@@ -71,6 +178,7 @@ def plot_wpma_air_time(df, legend):
     return fig
 
 
+@profiler.profiled
 def plot_narrative_emotion(df, legend):
     """
     Plots a stacked bar chart of emotion proportions by speaker and narrative type.
@@ -79,8 +187,8 @@ def plot_narrative_emotion(df, legend):
         df (pd.DataFrame): DataFrame containing the data.
         legend (dict): Dictionary mapping 'emotion' values to consistent colors.
     """
-    proportions = df.groupby(['name', 'nType', 'emotion']).size().reset_index(name='count')
-    totals = proportions.groupby(['name', 'nType'])['count'].transform('sum')
+    proportions = df.groupby(['name', 'nType', 'emotion'], observed=True).size().reset_index(name='count')
+    totals = proportions.groupby(['name', 'nType'], observed=True)['count'].transform('sum')
     proportions['proportion'] = proportions['count'] / totals
 
     fig = px.bar(
@@ -98,21 +206,25 @@ def plot_narrative_emotion(df, legend):
     return fig
 
 
+@profiler.profiled
 def plot_cluster_response_and_coherence(df, legend):
     """
-    Creates a scatter plot with linear regression lines for each name.
+    Creates a scatter plot with linear regression lines for each name. Above
+    WEBGL_THRESHOLD points the plot is rendered with WebGL.
 
     Parameters:
         df (pd.DataFrame): DataFrame containing the data.
         legend (dict): Dictionary mapping 'name' values to consistent colors.
     """
     df = df.dropna(subset=['coherenceScore', 'responseScore'])
-    grouped = df.groupby('name')
+    grouped = df.groupby('name', observed=True)
+    webgl = len(df) > WEBGL_THRESHOLD
+    scatter = go.Scattergl if webgl else go.Scatter
 
     fig = go.Figure()
 
     for name, group in grouped:
-        fig.add_trace(go.Scatter(
+        fig.add_trace(scatter(
             x=group['coherenceScore'],
             y=group['responseScore'],
             mode='markers',
@@ -126,10 +238,13 @@ def plot_cluster_response_and_coherence(df, legend):
             X = group['coherenceScore'].values.reshape(-1, 1)
             y = group['responseScore'].values
             model = LinearRegression().fit(X, y)
-            y_pred = model.predict(X)
 
-            fig.add_trace(go.Scatter(
-                x=group['coherenceScore'],
+            # A straight line only needs its end points when there are many points
+            x_line = np.array([X.min(), X.max()]) if webgl else group['coherenceScore']
+            y_pred = model.predict(np.asarray(x_line).reshape(-1, 1))
+
+            fig.add_trace(scatter(
+                x=x_line,
                 y=y_pred,
                 mode='lines',
                 name=f"{name} Regression",
@@ -151,7 +266,8 @@ def plot_cluster_response_and_coherence(df, legend):
     return fig
 
 
-def plot_proportions_response_and_coherence(df, legend):
+@profiler.profiled
+def plot_proportions_response_and_coherence(df, legend, summary=None):
     """
     Groups the dataframe by 'name' and classifies 'coherenceScore'-'responseScore' pairs
     into four clusters. Displays two subplots:
@@ -161,36 +277,9 @@ def plot_proportions_response_and_coherence(df, legend):
     Parameters:
         df (pd.DataFrame): DataFrame containing 'name', 'coherenceScore', and 'responseScore'.
         legend (dict): Dictionary mapping 'name' values to consistent colors.
+        summary (dict): Optional result of summarize(df), shared between figures.
     """
-    x_boundary, y_boundary = 0.35, 0.35
-
-    def classify_quadrant(row):
-        if row['coherenceScore'] < x_boundary and row['responseScore'] > y_boundary:
-            return 'Accommodating'
-        elif row['coherenceScore'] < x_boundary:
-            return 'Discontinuous'
-        elif row['responseScore'] <= y_boundary:
-            return 'Directive'
-        return 'Integrative'
-
-    df['cluster'] = df.apply(classify_quadrant, axis=1)
-    df['distance_to_boundary'] = np.sqrt(
-        (df['coherenceScore'] - x_boundary) ** 2 +
-        (df['responseScore'] - y_boundary) ** 2
-    )
-
-    cluster_counts = (
-        df.groupby(['name', 'cluster']).size()
-        .reset_index(name='count')
-    )
-    cluster_counts['proportion'] = (
-        cluster_counts['count'] / cluster_counts.groupby('name')['count'].transform('sum') * 100
-    )
-
-    avg_distances = (
-        df.groupby(['name', 'cluster'])['distance_to_boundary']
-        .mean().reset_index()
-    )
+    clusters = (summary or summarize(df))['clusters']
 
     fig = sp.make_subplots(
         rows=2, cols=1,
@@ -201,18 +290,18 @@ def plot_proportions_response_and_coherence(df, legend):
         vertical_spacing=0.2
     )
 
-    for name in cluster_counts['name'].unique():
-        data = cluster_counts[cluster_counts['name'] == name]
+    groups = list(clusters.groupby('name', observed=True))
+
+    for name, data in groups:
         fig.add_trace(go.Bar(
             x=data['cluster'],
             y=data['proportion'],
             name=name,
             marker=dict(color=legend.get(name, 'gray')),
-            showlegend=name not in [trace.name for trace in fig.data]
+            showlegend=True
         ), row=1, col=1)
 
-    for name in avg_distances['name'].unique():
-        data = avg_distances[avg_distances['name'] == name]
+    for name, data in groups:
         fig.add_trace(go.Bar(
             x=data['cluster'],
             y=data['distance_to_boundary'],
@@ -236,48 +325,44 @@ def plot_proportions_response_and_coherence(df, legend):
     return fig
 
 
-def plot_frequency_response_and_coherence(df, legend):
+@profiler.profiled
+def plot_frequency_response_and_coherence(df, legend, summary=None, x_range=None, max_bars=MAX_BARS):
     """
     Plots stacked bar charts of response and coherence scores grouped by name.
 
     Parameters:
         df (pd.DataFrame): DataFrame containing the data.
         legend (dict): Dictionary mapping 'name' values to consistent colors.
+        summary (dict): Optional result of summarize(df), shared between figures.
+        x_range (list): Visible [first, last] ID; the whole transcript by default.
+        max_bars (int): Bars per speaker beyond which IDs are aggregated into bins.
     """
-    x_range = [0, df['id'].max()]
-
-    response_df = (
-        df.groupby(["name", "responseID"])['responseScore']
-        .sum().reset_index(name="resScoreSum")
-    )
-    coherence_df = (
-        df.groupby(["name", "coherenceID"])['coherenceScore']
-        .sum().reset_index(name="cohScoreSum")
-    )
-    coherence_df['cohScoreSum'] *= -1
+    summary = summary or summarize(df)
+    # An empty selection has no IDs; its (empty) data is drawn unbinned
+    if x_range is None and not pd.isna(summary['maxId']):
+        x_range = [0, summary['maxId']]
 
     fig = sp.make_subplots(
         rows=2, cols=1, shared_xaxes=True, vertical_spacing=0
     )
 
     def add_traces(data, y_col, row):
-        added_names = set()
-        for name in data["name"].unique():
-            filtered_data = data[data["name"] == name]
+        data, bin_width = bin_scores(data, data.columns[1], x_range, max_bars)
+        for name, filtered_data in data.groupby("name", observed=True):
             fig.add_trace(
                 go.Bar(
                     x=filtered_data[data.columns[1]],
                     y=filtered_data[y_col],
+                    width=bin_width if bin_width > 1 else None,
                     name=name,
                     marker=dict(color=legend.get(name, 'gray')),
-                    showlegend=name not in added_names
+                    showlegend=True
                 ),
                 row=row, col=1
             )
-            added_names.add(name)
 
-    add_traces(response_df, "resScoreSum", row=1)
-    add_traces(coherence_df, "cohScoreSum", row=2)
+    add_traces(summary['response'], "resScoreSum", row=1)
+    add_traces(summary['coherence'], "cohScoreSum", row=2)
 
     for i, title in enumerate(["Response Scores", "Coherence Scores"], start=1):
         fig.update_yaxes(title_text=title, title_standoff=10, row=i, col=1)
@@ -295,45 +380,48 @@ def plot_frequency_response_and_coherence(df, legend):
     return fig
 
 
-def plot_repetition(df, legend):
+@profiler.profiled
+def plot_repetition(df, legend, summary=None, x_range=None, max_bars=MAX_BARS):
     """
     Plots repetition scores grouped by name and repeatID.
 
     Parameters:
         df (pd.DataFrame): DataFrame containing the data.
         legend (dict): Dictionary mapping 'name' values to consistent colors.
+        summary (dict): Optional result of summarize(df), shared between figures.
+        x_range (list): Visible [first, last] ID; the whole transcript by default.
+        max_bars (int): Bars per speaker beyond which IDs are aggregated into bins.
     """
-    repeat_df = (
-        df.groupby(["name", "repeatID"])["repeatScore"]
-        .sum().reset_index(name="repScoreSum")
-    )
+    summary = summary or summarize(df)
+    # An empty selection has no IDs; its (empty) data is drawn unbinned
+    if x_range is None and not pd.isna(summary['maxId']):
+        x_range = [0, summary['maxId']]
 
     fig = sp.make_subplots(rows=1, cols=1, shared_xaxes=True)
 
-    added_names = set()
-    for name in repeat_df["name"].unique():
-        filtered_data = repeat_df[repeat_df["name"] == name]
+    repeat_df, bin_width = bin_scores(summary['repeat'], "repeatID", x_range, max_bars)
+    for name, filtered_data in repeat_df.groupby("name", observed=True):
         fig.add_trace(
             go.Bar(
                 x=filtered_data["repeatID"],
                 y=filtered_data["repScoreSum"],
+                width=bin_width if bin_width > 1 else None,
                 name=name,
                 marker=dict(color=legend.get(name, 'gray')),
-                showlegend=name not in added_names
+                showlegend=True
             )
         )
-        added_names.add(name)
 
     fig.update_yaxes(title_text="Repetition Scores", title_standoff=10)
 
     fig.update_layout(
         height=400,
         width=1200,
-        xaxis=dict(range=[0, df['id'].max()]),
+        xaxis=dict(range=x_range),
         barmode='stack',
         template="plotly_white",
         legend_title="Names",
         title="Sum of Repeat Scores by Name"
     )
 
-    return fig
\ No newline at end of file
+    return fig